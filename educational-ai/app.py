@@ -1,111 +1,70 @@
 import usecase
+import json
+import multiprocessing
 import os
-import tensorflow as tf
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
-gpus = tf.config.experimental.list_physical_devices('GPU')
-if gpus:
-    try:
-        for gpu in gpus:
-            tf.config.experimental.set_memory_growth(gpu, True)
-    except RuntimeError as e:
-        print(e)
+# GPU memory growth, applied by TensorFlow when (and if) a training path imports it; prediction-only workers with the
+# numpy backend never import TensorFlow.
+os.environ.setdefault('TF_FORCE_GPU_ALLOW_GROWTH', 'true')
 
 import sys
-from itertools import zip_longest
+import time
 
 import numpy as np
-import pandas
-from keras.utils import pad_sequences
-from keras_preprocessing.text import Tokenizer
 from matplotlib import pyplot as plt
-from sklearn.model_selection import train_test_split
-
-from sklearn.metrics import confusion_matrix # aqui
 
-import tokenizer_utils as ts_utils
-import dataset_utils as ds_utils
-from flask import Flask, request, make_response, current_app, jsonify
+import dataset_cache
+import jobs
+import lock_utils
+import model_registry
+import service_metrics
+import teaching_progress
+from flask import Flask, Response, g, request, make_response, current_app, jsonify, stream_with_context
 from flask_cors import CORS
 from usecase import model_histories
 
 # Start a Flask App to serve an API.
 app = Flask(__name__)
-# Define stacked progress to plot machine teaching progression over different iterations.
-machine_teaching_progress = []
+# Bounded per-epoch record of machine teaching progression over different iterations, shared by every worker.
+machine_teaching_progress = teaching_progress.TeachingProgress()
+# Background training jobs, used by the endpoints called with ?async=true.
+training_jobs = jobs.JobManager()
 app.config['JSONIFY_MIMETYPE'] = 'application/json'
 CORS(app)
 
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+# Records the latency of every request, labeled with its URL rule so that model names do not become label values.
+@app.after_request
+def observe_request_latency(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        service_metrics.observe_request(request.method, route, response.status_code, start)
+    return response
+
+
 np.set_printoptions(threshold=sys.maxsize)
 plt.style.use('ggplot')
-tokenizer = Tokenizer(char_level=True, lower=True)
-# Load unordered dataSets for fine-tuning.
-dipt = ds_utils.load_dataset("./database/diptongos.csv", 0, 1, 3)
-hiat = ds_utils.load_dataset("./database/hiatos.csv", 0, 1, 3)
-none = ds_utils.load_dataset("./database/general.csv", 0, 1, 2)
-
-# Add fake word cases.
-# dipt = ds_utils.generate_fake_words(dipt)
-# hiat = ds_utils.generate_fake_words(hiat)
-# none = ds_utils.generate_fake_words(none)
-
-# Shuffle words.
-mixed = pandas.concat([dipt, hiat, none]).sort_values(by="DIFICULTAD")
-
-# Split in data and target.
-x, y = ds_utils.split_data(mixed, 2)
-
-# Save words without tokenization for guided machine-teaching.
-x0_unencoded = x[:, 0][:386]
-x1_unencoded = x[:, 0][386:596]
-
-# Set max length as padding.
-padding = len(max(x[:, 0], key=len))
-
-# Encoding of target.
-y = tf.keras.utils.to_categorical(y, num_classes=3)
-
-# Remove all 'h' chars from data to reduce complexity. DOES NOT IMPROVE ACCURACY.
-simplified_x = np.asarray([s.replace('h', '') for s in x[:, 0]])
-# Encoding of data.
-tokenizer.fit_on_texts(x[:, 0])
-tokenizer.word_index = ts_utils.customize_word_index(tokenizer.word_index)
-x = tokenizer.texts_to_sequences(x[:, 0])
-x = pad_sequences(x, maxlen=padding)
-x0 = x[:386]
-x1 = x[386:596]
-x2 = x[596:]
-
-y0 = y[:386, :]
-y1 = y[386:596, :]
-y2 = y[596:, :]
-
-# Split in train/test sets.
-# aqui, cambié el test_size (era 0.10 antes)
-x_train0, x_test0, y_train0, y_test0 = train_test_split(np.array(list(zip_longest(*x0, fillvalue=0))).T,
-                                                        y0, test_size=0.10)
-x_train1, x_test1, y_train1, y_test1 = train_test_split(np.array(list(zip_longest(*x1, fillvalue=0))).T,
-                                                        y1, test_size=0.10)
-x_train2, x_test2, y_train2, y_test2 = train_test_split(np.array(list(zip_longest(*x2, fillvalue=0))).T,
-                                                        y2, test_size=0.10)
-
-# Same splits for automated machine teaching.
-
-x_train0_unencoded, _, _, _ = train_test_split(x0_unencoded, y0, test_size=0.10)
-x_train1_unencoded, _, _, _ = train_test_split(x1_unencoded, y1, test_size=0.10)
-
-# Generate full train and test datasets.
-x_train = np.concatenate((x_train0, x_train1, x_train2))
-x_test = np.concatenate((x_test0, x_test1, x_test2))
-y_train = np.concatenate((y_train0, y_train1, y_train2))
-y_test = np.concatenate((y_test0, y_test1, y_test2))
-
-# Generate progression for modified Baby-Step.
-x_increment_01 = np.concatenate((x_train0, x_train1))
-x_increment_01_unencoded = np.concatenate((x_train0_unencoded, x_train1_unencoded))
-x_increment_012 = np.concatenate((x_train0, x_train1, x_train2))
-y_increment_01 = np.concatenate((y_train0, y_train1))
-y_increment_012 = np.concatenate((y_train0, y_train1, y_train2))
+
+# Load the encoded dataSets (built once per CSV version, then memory-mapped by every worker).
+dataset, tokenizer, padding = dataset_cache.load_or_build()
+x, y = dataset['x'], dataset['y']
+x_train, y_train = dataset['x_train'], dataset['y_train']
+x_test, y_test = dataset['x_test'], dataset['y_test']
+x_train0, y_train0 = dataset['x_train0'], dataset['y_train0']
+
+# Progression for modified Baby-Step.
+x_increment_01, y_increment_01 = dataset['x_increment_01'], dataset['y_increment_01']
+x_increment_012, y_increment_012 = dataset['x_increment_012'], dataset['y_increment_012']
+
+# Words without tokenization for guided machine-teaching.
+x_increment_01_unencoded = dataset['x_increment_01_unencoded']
 
 models_dir = os.path.join(os.getcwd(), 'models')
 default_models = [
@@ -119,10 +78,18 @@ default_models = [
     'curriculum_under_trained_k_folds.keras'
 ]
 models_missing = [model for model in default_models if not os.path.exists(os.path.join(models_dir, model))]
+# Index the models stored before the registry existed.
+if usecase.registry.count() == 0:
+    usecase.registry.rebuild(models_dir)
 
-if models_missing:
-    usecase.reset(x, y, x_train, y_train, x_train0, y_train0, x_increment_01,
-                  y_increment_01, x_increment_012, y_increment_012, models_missing)
+# Train missing default models in the background so the server starts right away. Spawned job workers import this
+# module too and must not provision again.
+provisioning_job = None
+if models_missing and multiprocessing.parent_process() is None:
+    provisioning_job = training_jobs.submit('provision', jobs.provision_job,
+                                            (x, y, x_train, y_train, x_train0, y_train0, x_increment_01,
+                                             y_increment_01, x_increment_012, y_increment_012, default_models,
+                                             models_dir), [])
 
 
 # Root
@@ -131,12 +98,32 @@ def root():
     return '¡Bienvenido a la aplicación!'
 
 
+# Reports which default models are available yet.
+@app.get('/ready')
+def readiness():
+    available = [model for model in default_models if os.path.exists(os.path.join(models_dir, model))]
+    missing = [model for model in default_models if model not in available]
+    status = {"ready": not missing, "available": available, "missing": missing}
+    if provisioning_job is not None:
+        job = training_jobs.get(provisioning_job['id'])
+        status["provisioning"] = {key: job[key] for key in ('id', 'status', 'progress', 'error')} if job else None
+    return jsonify(status), 200 if not missing else 503
+
+
 # Resets models to default with a new fresh training.
 @app.route('/reset-models', methods=['POST'])
 def reset_models():
+    if is_async_request():
+        job = training_jobs.submit('reset', jobs.reset_job,
+                                   (x, y, x_train, y_train, x_train0, y_train0, x_increment_01, y_increment_01,
+                                    x_increment_012, y_increment_012, None), default_models)
+        return jsonify_job_accepted(job)
     try:
-        usecase.reset(x, y, x_train, y_train, x_train0, y_train0, x_increment_01, y_increment_01, x_increment_012,
-                      y_increment_012)
+        # Same locks as the reset and provisioning jobs, which write the same default models and temporary files.
+        with lock_utils.model_locks(default_models):
+            usecase.reset(x, y, x_train, y_train, x_train0, y_train0, x_increment_01, y_increment_01, x_increment_012,
+                          y_increment_012)
+            usecase.model_writer.flush()
         # Return a success message
         return jsonify({'message': 'Models have been reset and retrained successfully.'}), 200
     except Exception as e:
@@ -153,15 +140,32 @@ def load_new_model(model_name):
 # Handles the restart of a class.
 @app.route('/class/<class_code>/delete', methods=['PUT'])
 def delete_class(class_code):
-    usecase.handle_class_deletion(class_code)
+    # The training locks make other workers write their pending saves of the students before they are moved.
+    with lock_utils.model_locks(usecase.list_class_models(class_code)):
+        usecase.handle_class_deletion(class_code)
     return jsonify({"message": "Class deleted successfully"}), 200
 
 
+# Classifies a JSON list of words with every student model of the class.
+@app.route('/class/<class_code>/predict', methods=['POST'])
+def make_class_prediction(class_code):
+    words = request.get_json(silent=True)
+    if not isinstance(words, list) or not words or not all(isinstance(word, str) for word in words):
+        return jsonify({"error": "A non-empty JSON list of words is required"}), 400
+    try:
+        return jsonify(usecase.predict_class(class_code, tokenizer, words, padding))
+    except FileNotFoundError:
+        return jsonify({'error': 'Class not found'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 # Deletes a stored model.
 @app.route('/models/<model_name>', methods=['DELETE'])
 def delete_model(model_name):
     try:
-        usecase.delete_model(model_name)
+        with lock_utils.model_locks([model_name]):
+            usecase.delete_model(model_name)
         return jsonify_no_content()
     except FileNotFoundError:
         return jsonify({'error': 'Model not found'}), 404
@@ -173,8 +177,15 @@ def delete_model(model_name):
 @app.route('/models/<model_name>/train', methods=['POST'])
 def train_model(model_name):
     words = request.get_json()
-    progress, mistakes = usecase.teach(model_name, words, tokenizer, padding) # aqui
-    machine_teaching_progress.append(progress)
+    class_code = usecase.extract_class_code_from_name(model_name)
+    if is_async_request():
+        job = training_jobs.submit('train', jobs.teach_job, (model_name, words, tokenizer, padding), [model_name],
+                                   on_finished=lambda job: machine_teaching_progress.record(
+                                       model_name, class_code, job['result']['history'], len(words)))
+        return jsonify_job_accepted(job)
+    with lock_utils.model_locks([model_name]):
+        progress, mistakes = usecase.teach(model_name, words, tokenizer, padding) # aqui
+    machine_teaching_progress.record(model_name, class_code, progress.history, len(words))
     response = jsonify(mistakes.tolist()) # aqui
     return response, 200, {'Content-Type': 'application/json'}
 
@@ -186,33 +197,48 @@ def make_prediction(model_name, word):
     return jsonify(result)
 
 
+# Uses the given model to classify a JSON list of words in one batch.
+@app.route('/models/<model_name>/predict', methods=['POST'])
+def make_batch_prediction(model_name):
+    words = request.get_json(silent=True)
+    if not isinstance(words, list) or not words or not all(isinstance(word, str) for word in words):
+        return jsonify({"error": "A non-empty JSON list of words is required"}), 400
+    try:
+        return jsonify(usecase.predict_batch(model_name, tokenizer, words, padding))
+    except FileNotFoundError:
+        return jsonify({'error': 'Model not found'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 # Tests the model against the fixed test dataSet.
 @app.post('/models/test')
 def test_models():
     model_names = request.json.get('model_names')
     if not model_names:
         return {"error": "No model names provided"}, 400
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        # One JSON line per model, sent as soon as that model has been evaluated.
+        return Response(stream_with_context(stream_evaluations(model_names)), mimetype='application/x-ndjson')
     return usecase.evaluate(model_names, x_test, y_test)
 
 
+def stream_evaluations(model_names):
+    for model_name, evaluation, error in usecase.iter_evaluate(model_names, x_test, y_test):
+        if error is not None:
+            yield json.dumps({"model": model_name, "error": str(error)}) + "\n"
+        else:
+            yield json.dumps({"model": model_name, "metrics": evaluation["metrics"]}) + "\n"
+
+
 @app.route('/models/<model_name>/matrix', methods=['POST'])
 def get_confusion_matrix(model_name):
     try:
-        # Load the model
-        model = usecase.get_pretrained_model(model_name)
-        
-        # Predict the classes of the test dataset
-        predictions = model.predict(np.expand_dims(x_test, axis=2))
-        predicted_classes = np.argmax(predictions, axis=1)
-        
-        # Convert the true labels to class indices
-        true_classes = np.argmax(y_test, axis=1)
-        
-        # Calculate the confusion matrix
-        cm = confusion_matrix(true_classes, predicted_classes)
-        
+        # Shares the cached test-set evaluation with /models/test.
+        evaluation = usecase.evaluate_model(model_name, x_test, y_test)
+
         # Return the confusion matrix as a JSON response
-        return jsonify(cm.tolist()), 200
+        return jsonify(evaluation['confusion_matrix']), 200
     except Exception as e:
         # In case of an error, return an error message
         return jsonify({'error': str(e)}), 500
@@ -220,10 +246,31 @@ def get_confusion_matrix(model_name):
 # Retrieves the models list
 @app.get('/models')
 def get_model_names():
-    models_folder = os.path.join(os.getcwd(), 'models')
-    filenames = [os.path.splitext(file)[0] for file in os.listdir(models_folder)]
-    print(filenames)
-    return jsonify(filenames)
+    return jsonify_model_list()
+
+
+# Lists the models of a class, with the same filters and pagination as /models.
+@app.get('/class/<class_code>/models')
+def get_class_model_names(class_code):
+    return jsonify_model_list(class_code=class_code)
+
+
+# Retrieves the hit/miss counters of the in-process model cache.
+@app.get('/models/cache')
+def get_model_cache_stats():
+    return jsonify(usecase.loaded_models.stats())
+
+
+# Prometheus metrics of every worker (route latencies, model operations, model file I/O, caches and training jobs).
+@app.get('/metrics')
+def get_metrics():
+    return Response(service_metrics.render(), mimetype=service_metrics.CONTENT_TYPE)
+
+
+# Retrieves the counters of the in-process prediction cache and the size of the loaded vocabulary tables.
+@app.get('/models/predictions/cache')
+def get_prediction_cache_stats():
+    return jsonify(usecase.predictions.stats())
 
 
 # Retrieves the selected model history.
@@ -231,12 +278,94 @@ def get_model_names():
 def get_history(model_name, extension='.keras'):
     if not model_name.endswith(extension):
         model_name += extension
-    if model_name in model_histories:
-        return jsonify(model_histories[model_name]), 200
+    # Optional downsampling for long histories: ?max_points=<n> returns at most n evenly spaced epochs.
+    max_points = request.args.get('max_points', type=int)
+    if max_points is not None and max_points < 1:
+        return jsonify({"error": "max_points must be a positive integer"}), 400
+    history = model_histories.get(model_name, max_points=max_points)
+    if history is not None:
+        return jsonify(history), 200
     else:
         return jsonify({"error": "Model not found"}), 404
 
 
+# Retrieves the machine teaching progress of a model, aggregated per teaching session.
+@app.get('/models/<model_name>/teaching-progress')
+def get_model_teaching_progress(model_name):
+    progress = machine_teaching_progress.for_model(model_name)
+    if progress is None:
+        return jsonify({"error": "No teaching progress for this model"}), 404
+    return jsonify(progress), 200
+
+
+# Retrieves the machine teaching progress of every model of a class.
+@app.get('/class/<class_code>/teaching-progress')
+def get_class_teaching_progress(class_code):
+    progress = machine_teaching_progress.for_class(class_code)
+    if progress is None:
+        return jsonify({"error": "No teaching progress for this class"}), 404
+    return jsonify(progress), 200
+
+
+# Retrieves the status and progress of a training job.
+@app.get('/jobs/<job_id>')
+def get_job(job_id):
+    job = training_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({key: value for key, value in job.items() if key != 'result'}), 200
+
+
+# Retrieves the result of a finished training job.
+@app.get('/jobs/<job_id>/result')
+def get_job_result(job_id):
+    job = training_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job['status'] == 'failed':
+        return jsonify({"error": job['error']}), 500
+    if job['status'] != 'finished':
+        return jsonify({"status": job['status'], "progress": job['progress']}), 202
+    return jsonify(job['result']), 200
+
+
+def is_async_request():
+    return request.args.get('async', '').lower() in ('1', 'true', 'yes')
+
+
+# Lists the registry models matching the query: ?class_code=, ?student=, ?archived=true, ?defaults=true|false and
+# ?order_by=. The response is the JSON list of their names; only when ?page=, ?limit= or ?offset= is given it is a page
+# {models, total, limit, offset} of registry rows (page n of limit models starts at offset (n - 1) * limit).
+def jsonify_model_list(class_code=None):
+    defaults = request.args.get('defaults')
+    paginated = any(key in request.args for key in ('page', 'limit', 'offset'))
+    limit = min(max(request.args.get('limit', 100, type=int), 0), model_registry.MAX_PAGE_SIZE)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    page = request.args.get('page', type=int)
+    if page is not None:
+        offset = (max(page, 1) - 1) * limit
+    try:
+        models, total = usecase.registry.list(
+            class_code=class_code or request.args.get('class_code'),
+            student=request.args.get('student'),
+            archived=request.args.get('archived', '').lower() in ('1', 'true', 'yes'),
+            defaults=None if defaults is None else defaults.lower() in ('1', 'true', 'yes'),
+            limit=limit if paginated else None,
+            offset=offset,
+            order_by=request.args.get('order_by', 'name'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not paginated:
+        return jsonify([model['name'] for model in models]), 200
+    return jsonify({"models": models, "total": total, "limit": limit, "offset": offset}), 200
+
+
+# Makes a 202 response pointing to the status of a submitted job.
+def jsonify_job_accepted(job):
+    response = jsonify({"job_id": job['id'], "status": job['status'], "status_url": f"/jobs/{job['id']}"})
+    return response, 202, {'Location': f"/jobs/{job['id']}"}
+
+
 # Makes an application/json response for 204 in Flask.
 def jsonify_no_content():
     response = make_response('', 204)
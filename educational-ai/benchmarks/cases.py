@@ -0,0 +1,142 @@
+import argparse
+import datetime
+import json
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import workspace
+
+# Benchmark cases, run by run_benchmarks.py inside a workspace (the current directory). Requests go through the Flask
+# test client and model operations through usecase, like the app does. Each case is timed `repeat` times, after
+# dropping the caches that would otherwise hide the work being measured.
+
+CASES = ['cold_start', 'load_model', 'predict_single', 'predict_single_cached', 'predict_batch', 'teach', 'evaluate',
+         'matrix', 'load_new', 'reset']
+CLASS_CODE = "BENCH"
+
+
+def measure(function, repeat, setup=None):
+    samples = []
+    for index in range(repeat):
+        if setup is not None:
+            setup(index)
+        start = time.perf_counter()
+        function(index)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(samples):
+    return {
+        'median': float(np.median(samples)),
+        'mean': float(np.mean(samples)),
+        'min': float(np.min(samples)),
+        'max': float(np.max(samples)),
+        'p95': float(np.percentile(samples, 95)),
+        'samples': len(samples)
+    }
+
+
+# Students are named the way the frontend (server.js) names them: <name>_<class_code>_<YYYYMMDDTHHMMSS>.
+def student_name(index):
+    created = datetime.datetime(2024, 10, 2, 15, 30, 12) + datetime.timedelta(seconds=index)
+    return f"bench{index}_{CLASS_CODE}_{created:%Y%m%dT%H%M%S}"
+
+
+def check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.path} answered {response.status_code}: "
+                           f"{response.get_data(as_text=True)[:200]}")
+    return response
+
+
+def run(cases, repeat, models, batch_size, seed):
+    import dataset_cache
+    import model_registry
+    dataset, _, _ = dataset_cache.load_or_build()
+    workspace.build_models('models', dataset['x_train'], dataset['y_train'], seed)
+    model_registry.ModelRegistry().rebuild('models')
+    results = {}
+
+    if 'cold_start' in cases:
+        print("(BM) cold_start ...")
+        results['cold_start'] = summarize(measure(
+            lambda index: subprocess.run([sys.executable, '-c', 'import app'], check=True,
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL),
+            max(1, repeat // 4)))
+
+    import app
+    import usecase
+    client = app.app.test_client()
+    generator = random.Random(seed)
+    words = [str(word) for word in dataset['x_increment_01_unencoded']]
+    teaching_words = {word: generator.choice('DHG') for word in words[:10]}
+    base_model_name = "curriculum_under_trained_k_folds"
+
+    # Students taught once, so they have their own model files.
+    students = [student_name(index) for index in range(models)]
+    for model_name in students:
+        check(client.post(f'/models/{model_name}'))
+        check(client.post(f'/models/{model_name}/train', json=teaching_words))
+    usecase.model_writer.flush()
+    student = students[0]
+
+    def run_case(name, function, setup=None, times=repeat):
+        if name in cases:
+            print(f"(BM) {name} ...")
+            results[name] = summarize(measure(function, times, setup))
+
+    run_case('load_model', lambda index: usecase.get_pretrained_model(base_model_name),
+             setup=lambda index: usecase.loaded_models.clear())
+    run_case('predict_single',
+             lambda index: check(client.put(f'/models/{student}/predict/{words[index % len(words)]}')),
+             setup=lambda index: usecase.predictions.invalidate(student))
+    run_case('predict_single_cached', lambda index: check(client.put(f'/models/{student}/predict/{words[0]}')))
+    run_case('predict_batch', lambda index: check(client.post(f'/models/{student}/predict', json=words[:batch_size])),
+             setup=lambda index: usecase.predictions.invalidate(student))
+    run_case('teach', lambda index: check(client.post(f'/models/{student}/train', json=teaching_words)))
+    usecase.model_writer.flush()
+    run_case('evaluate', lambda index: check(client.post('/models/test', json={'model_names': students})),
+             setup=lambda index: [usecase.evaluations.invalidate(model_name) for model_name in students])
+    run_case('matrix', lambda index: check(client.post(f'/models/{student}/matrix')),
+             setup=lambda index: usecase.evaluations.invalidate(student))
+    run_case('load_new', lambda index: check(client.post(f'/models/{student_name(models + index)}')))
+    run_case('reset', lambda index: run_reset(app, usecase), times=1)
+    usecase.model_writer.flush()
+    return results
+
+
+# Writes the pending saves and stops the job pool and the export thread of the app, so the process exits on its own.
+def shutdown():
+    import app
+    import usecase
+    usecase.model_writer.flush()
+    usecase.tflite_exporter.shutdown(wait=True)
+    app.training_jobs.shutdown(wait=True)
+
+
+# Retrains every default model, as a reset of a fresh deployment does.
+def run_reset(app, usecase):
+    usecase.reset(app.x, app.y, app.x_train, app.y_train, app.x_train0, app.y_train0, app.x_increment_01,
+                  app.y_increment_01, app.x_increment_012, app.y_increment_012,
+                  [model_name + ".keras" for model_name in workspace.DEFAULT_MODELS])
+    usecase.model_writer.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs the benchmark cases in the current workspace.")
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--models', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', required=True)
+    arguments = parser.parse_args()
+    results = run(arguments.cases, arguments.repeat, arguments.models, arguments.batch_size, arguments.seed)
+    with open(arguments.output, 'w') as output_file:
+        json.dump(results, output_file)
+    shutdown()
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import cases as benchmark_cases
+import workspace
+
+# Benchmark suite for the serving and training hot paths. Every run builds a fresh workspace in a temporary directory
+# (application sources, seeded synthetic word lists and small synthetic models), runs cases.py there in a new
+# interpreter, and writes the timings to a JSON file. Given a baseline file, every case whose median is more than
+# `threshold` slower than in the baseline is reported as a regression and the run exits with status 1.
+#
+#   python benchmarks/run_benchmarks.py --save-baseline      # records benchmarks/baseline.json on this machine
+#   python benchmarks/run_benchmarks.py --output results.json  # compares a run with it
+#   python benchmarks/run_benchmarks.py --cases predict_single teach --baseline other_baseline.json
+#
+# Timings depend on the machine, so no baseline is committed: record one on the machine that runs the comparisons.
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+DEFAULT_THRESHOLD = 0.25
+
+
+def run(cases=None, repeat=20, models=8, batch_size=64, seed=0, keep=None):
+    workspace_dir = keep or tempfile.mkdtemp(prefix='educational-ai-bench-')
+    workspace.create(workspace_dir, seed)
+    results_path = os.path.join(workspace_dir, 'results.json')
+    command = [sys.executable, os.path.join(BENCHMARKS_DIR, 'cases.py'), '--output', results_path,
+               '--repeat', str(repeat), '--models', str(models), '--batch-size', str(batch_size), '--seed', str(seed)]
+    if cases:
+        command += ['--cases'] + list(cases)
+    environment = dict(os.environ, PYTHONPATH=workspace_dir, PYTHONHASHSEED=str(seed), TF_CPP_MIN_LOG_LEVEL='2',
+                       MODEL_REGISTRY_DB=os.path.join(workspace_dir, 'models', '.registry.sqlite3'),
+                       HISTORY_DB=os.path.join(workspace_dir, 'histories.sqlite3'),
+                       TUNING_DIR=os.path.join(workspace_dir, 'tuning'))
+    try:
+        subprocess.run(command, cwd=workspace_dir, env=environment, check=True)
+        with open(results_path) as results_file:
+            results = json.load(results_file)
+    finally:
+        if keep is None:
+            shutil.rmtree(workspace_dir, ignore_errors=True)
+    return {
+        'meta': {
+            'created_at': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeat': repeat,
+            'models': models,
+            'batch_size': batch_size,
+            'seed': seed
+        },
+        'results': results
+    }
+
+
+# Returns (case, baseline median, current median, ratio, regressed) for the cases measured in both runs.
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    rows = []
+    for case, stats in current['results'].items():
+        reference = baseline['results'].get(case)
+        if reference is None or reference['median'] <= 0:
+            continue
+        ratio = stats['median'] / reference['median']
+        rows.append((case, reference['median'], stats['median'], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def print_comparison(rows, threshold):
+    print(f"{'case':<24}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for case, reference, median, ratio, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{case:<24}{reference * 1000:>10.1f}ms{median * 1000:>10.1f}ms{ratio:>8.2f}{flag}")
+    print(f"(BM) Threshold: medians more than {threshold:.0%} slower than the baseline.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the serving and training hot paths.")
+    parser.add_argument('--cases', nargs='+', choices=benchmark_cases.CASES)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--models', type=int, default=8, help="student models evaluated by the evaluate case")
+    parser.add_argument('--batch-size', type=int, default=64, help="words per request of the predict_batch case")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--keep', help="run in this directory and keep it, instead of a temporary one")
+    arguments = parser.parse_args()
+
+    current = run(arguments.cases, arguments.repeat, arguments.models, arguments.batch_size, arguments.seed,
+                  arguments.keep)
+    with open(arguments.output, 'w') as output_file:
+        json.dump(current, output_file, indent=2)
+    print(f"(BM) Results written to {arguments.output}.")
+    if arguments.save_baseline:
+        with open(arguments.baseline, 'w') as baseline_file:
+            json.dump(current, baseline_file, indent=2)
+        print(f"(BM) Baseline written to {arguments.baseline}.")
+    elif os.path.exists(arguments.baseline):
+        with open(arguments.baseline) as baseline_file:
+            rows = compare(current, json.load(baseline_file), arguments.threshold)
+        print_comparison(rows, arguments.threshold)
+        if any(regressed for *_, regressed in rows):
+            sys.exit(1)
+    else:
+        print(f"(BM) No baseline at {arguments.baseline}: record one with --save-baseline to compare the next runs.")
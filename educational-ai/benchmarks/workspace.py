@@ -0,0 +1,88 @@
+import glob
+import os
+import random
+import shutil
+
+# Isolated benchmark workspace: a copy of the application sources next to seeded synthetic word lists and small
+# synthetic default models, so the benchmarks never read or write the real models, registry or dataset bundle.
+
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORDS_PER_CLASS = 300
+DEFAULT_MODELS = [
+    'curriculum_max',
+    'curriculum_under_trained',
+    'max',
+    'under_trained',
+    'max_k_folds',
+    'curriculum_max_k_folds',
+    'under_trained_k_folds',
+    'curriculum_under_trained_k_folds'
+]
+CONSONANTS = "bcdfglmnprstv"
+DIPHTHONGS = ["ai", "au", "ei", "eu", "ia", "ie", "io", "iu", "oi", "ua", "ue", "ui", "uo"]
+HIATUSES = ["aí", "aú", "eí", "eú", "ía", "íe", "ío", "oí", "úa", "úe", "úo", "ae", "ea", "eo", "oa", "oe"]
+VOWELS = "aeiou"
+
+
+def create(workspace_dir, seed=0, source_dir=SOURCE_DIR):
+    os.makedirs(os.path.join(workspace_dir, 'database'), exist_ok=True)
+    os.makedirs(os.path.join(workspace_dir, 'models'), exist_ok=True)
+    for source in glob.glob(os.path.join(source_dir, '*.py')):
+        shutil.copy(source, workspace_dir)
+    write_datasets(os.path.join(workspace_dir, 'database'), seed)
+    return workspace_dir
+
+
+# Writes diptongos.csv, hiatos.csv and general.csv with the same columns as the real ones. Every word is made of
+# consonant-vowel syllables, with one diphthong (diptongos), one hiatus (hiatos) or neither (general), and the files
+# use the latin1 encoding dataset_utils reads them with.
+def write_datasets(database_dir, seed=0):
+    generator = random.Random(seed)
+
+    def word(nucleus=None, length=None):
+        syllables = [generator.choice(CONSONANTS) + generator.choice(VOWELS)
+                     for _ in range(length or generator.randint(1, 5))]
+        if nucleus is not None:
+            syllables.insert(generator.randint(0, len(syllables)), generator.choice(CONSONANTS) + nucleus)
+        return "".join(syllables)[:16]
+
+    with open(os.path.join(database_dir, 'diptongos.csv'), 'w', encoding='latin1') as csv_file:
+        csv_file.write("PALABRA;DIFICULTAD;TIPO;OBJETIVO\n")
+        for _ in range(WORDS_PER_CLASS):
+            csv_file.write(f"{word(generator.choice(DIPHTHONGS))};{generator.randint(0, 3)};creciente;0\n")
+    with open(os.path.join(database_dir, 'hiatos.csv'), 'w', encoding='latin1') as csv_file:
+        csv_file.write("PALABRA;DIFICULTAD;TIPO;OBJETIVO\n")
+        for _ in range(WORDS_PER_CLASS):
+            csv_file.write(f"{word(generator.choice(HIATUSES))};{generator.randint(0, 3)};a;1\n")
+    with open(os.path.join(database_dir, 'general.csv'), 'w', encoding='latin1') as csv_file:
+        csv_file.write("PALABRA;DIFICULTAD;OBJETIVO\n")
+        # The longest word sets the padding of the dataset, which must be the 16 inputs of the models.
+        csv_file.write(f"{word(length=8)};3;2\n")
+        for _ in range(WORDS_PER_CLASS - 1):
+            csv_file.write(f"{word()};{generator.randint(0, 3)};2\n")
+
+
+# Small Conv1D model with the input and output of the real ones.
+def synthetic_model():
+    import keras
+    model = keras.models.Sequential([
+        keras.Input(shape=(16, 1)),
+        keras.layers.Conv1D(filters=16, kernel_size=3, activation="relu", padding='same'),
+        keras.layers.MaxPooling1D(pool_size=2),
+        keras.layers.Flatten(),
+        keras.layers.Dense(16, activation="relu"),
+        keras.layers.Dense(3, activation='softmax')
+    ])
+    model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+
+# Trains one synthetic model for an epoch on x_train and saves it as every default model.
+def build_models(models_dir, x_train, y_train, seed=0):
+    import keras
+    import numpy as np
+    keras.utils.set_random_seed(seed)
+    model = synthetic_model()
+    model.fit(np.expand_dims(x_train, axis=2), y_train, epochs=1, verbose=0)
+    for model_name in DEFAULT_MODELS:
+        model.save(os.path.join(models_dir, model_name + ".keras"))
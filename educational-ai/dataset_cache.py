@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+
+# Precomputed, versioned bundle of the encoded dataset. The CSVs are read, tokenized, padded and split once; the
+# resulting arrays are stored as .npy files under database/.cache/<key>/ and loaded memory-mapped, so every gunicorn
+# worker shares the same pages instead of rebuilding them. The key hashes the CSV contents and DATASET_VERSION, so
+# editing a CSV or the preparation code (bump the version) produces a new bundle.
+
+DATASET_VERSION = 1
+CACHE_DIR = "./database/.cache"
+DATASETS = [
+    ("./database/diptongos.csv", 0, 1, 3),
+    ("./database/hiatos.csv", 0, 1, 3),
+    ("./database/general.csv", 0, 1, 2)
+]
+
+
+def dataset_key(datasets=DATASETS):
+    digest = hashlib.sha1(f"v{DATASET_VERSION}".encode())
+    for filename, *columns in datasets:
+        digest.update(str(columns).encode())
+        with open(filename, 'rb') as csv_file:
+            digest.update(csv_file.read())
+    return digest.hexdigest()[:16]
+
+
+def build(datasets=DATASETS):
+    import pandas
+    import keras
+    from keras_preprocessing.text import Tokenizer
+    from sklearn.model_selection import train_test_split
+    import dataset_utils as ds_utils
+    import tokenizer_utils as ts_utils
+
+    tokenizer = Tokenizer(char_level=True, lower=True)
+    # Load unordered dataSets for fine-tuning.
+    dipt, hiat, none = [ds_utils.load_dataset(*dataset) for dataset in datasets]
+
+    # Shuffle words.
+    mixed = pandas.concat([dipt, hiat, none]).sort_values(by="DIFICULTAD")
+
+    # Split in data and target.
+    x, y = ds_utils.split_data(mixed, 2)
+    words = x[:, 0].astype(str)
+
+    # Save words without tokenization for guided machine-teaching.
+    x0_unencoded = words[:386]
+    x1_unencoded = words[386:596]
+
+    # Set max length as padding.
+    padding = len(max(words, key=len))
+
+    # Encoding of target.
+    y = keras.utils.to_categorical(y, num_classes=3)
+
+    # Remove all 'h' chars from data to reduce complexity. DOES NOT IMPROVE ACCURACY.
+    simplified_x = np.asarray([s.replace('h', '') for s in words])
+    # Encoding of data.
+    tokenizer.fit_on_texts(words)
+    tokenizer.word_index = ts_utils.customize_word_index(tokenizer.word_index)
+    x = ts_utils.encode_words(tokenizer, words, padding)
+    x0 = x[:386]
+    x1 = x[386:596]
+    x2 = x[596:]
+
+    y0 = y[:386, :]
+    y1 = y[386:596, :]
+    y2 = y[596:, :]
+
+    # Split in train/test sets. The rows are already padded to the same length, so no transposition is needed.
+    x_train0, x_test0, y_train0, y_test0 = train_test_split(x0, y0, test_size=0.10)
+    x_train1, x_test1, y_train1, y_test1 = train_test_split(x1, y1, test_size=0.10)
+    x_train2, x_test2, y_train2, y_test2 = train_test_split(x2, y2, test_size=0.10)
+
+    # Same splits for automated machine teaching.
+    x_train0_unencoded, _, _, _ = train_test_split(x0_unencoded, y0, test_size=0.10)
+    x_train1_unencoded, _, _, _ = train_test_split(x1_unencoded, y1, test_size=0.10)
+
+    arrays = {
+        'x': x,
+        'y': y,
+        'simplified_x': simplified_x,
+        'x0_unencoded': x0_unencoded,
+        'x1_unencoded': x1_unencoded,
+        'x_train0': x_train0,
+        'y_train0': y_train0,
+        # Generate full train and test datasets.
+        'x_train': np.concatenate((x_train0, x_train1, x_train2)),
+        'x_test': np.concatenate((x_test0, x_test1, x_test2)),
+        'y_train': np.concatenate((y_train0, y_train1, y_train2)),
+        'y_test': np.concatenate((y_test0, y_test1, y_test2)),
+        # Generate progression for modified Baby-Step.
+        'x_increment_01': np.concatenate((x_train0, x_train1)),
+        'x_increment_01_unencoded': np.concatenate((x_train0_unencoded, x_train1_unencoded)),
+        'x_increment_012': np.concatenate((x_train0, x_train1, x_train2)),
+        'y_increment_01': np.concatenate((y_train0, y_train1)),
+        'y_increment_012': np.concatenate((y_train0, y_train1, y_train2))
+    }
+    return arrays, tokenizer, padding
+
+
+def save(bundle_dir, arrays, tokenizer, padding):
+    # Write into a private directory and rename it, so concurrent workers never read a partial bundle.
+    tmp_dir = f"{bundle_dir}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, name + ".npy"), np.ascontiguousarray(array))
+    with open(os.path.join(tmp_dir, "manifest.json"), 'w') as manifest:
+        json.dump({'version': DATASET_VERSION, 'arrays': sorted(arrays), 'padding': padding,
+                   'tokenizer': tokenizer.to_json()}, manifest)
+    try:
+        os.rename(tmp_dir, bundle_dir)
+    except OSError:
+        # Another worker published the same bundle first.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def load(bundle_dir):
+    from keras_preprocessing.text import tokenizer_from_json
+    with open(os.path.join(bundle_dir, "manifest.json")) as manifest_file:
+        manifest = json.load(manifest_file)
+    arrays = {name: np.load(os.path.join(bundle_dir, name + ".npy"), mmap_mode='r') for name in manifest['arrays']}
+    return arrays, tokenizer_from_json(manifest['tokenizer']), manifest['padding']
+
+
+def load_or_build(datasets=DATASETS, cache_dir=CACHE_DIR):
+    bundle_dir = os.path.join(cache_dir, dataset_key(datasets))
+    if not os.path.exists(os.path.join(bundle_dir, "manifest.json")):
+        print(f"(DC) Building dataset bundle {bundle_dir} ...")
+        os.makedirs(cache_dir, exist_ok=True)
+        save(bundle_dir, *build(datasets))
+    return load(bundle_dir)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--rebuild':
+        shutil.rmtree(os.path.join(CACHE_DIR, dataset_key()), ignore_errors=True)
+    arrays, _, _ = load_or_build()
+    print(f"(DC) Dataset bundle {dataset_key()} ready with {len(arrays)} arrays.")
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+
+import model_persistence
+
+# Student models are clones of one base model that drift slowly while they are taught, so they are stored as the
+# bitwise XOR between their float32 weights and the base weights. Untouched weights become zeros and compress
+# away, and XOR makes the reconstruction bit-exact. The base weights a delta was taken against are kept once
+# under models/.bases/ (content addressed), so deltas stay readable after the default models are retrained.
+# The optimizer of the student (its config and variables, e.g. the Adam moments of its teaching rounds) is stored in
+# the same file, so a student reloaded from its delta resumes training where its last session left off, as it does
+# from a .keras file.
+
+DELTA_EXTENSION = ".delta.npz"
+BASES_DIR = ".bases"
+
+_base_weights = {}
+_lock = threading.Lock()
+
+
+def delta_path(keras_path):
+    return os.path.splitext(keras_path)[0] + DELTA_EXTENSION
+
+
+def weights_fingerprint(weights):
+    digest = hashlib.sha1()
+    for weight in weights:
+        digest.update(str(weight.shape).encode())
+        digest.update(np.ascontiguousarray(weight, dtype='float32').tobytes())
+    return digest.hexdigest()
+
+
+def _bases_dir(models_dir):
+    return os.path.join(models_dir, BASES_DIR)
+
+
+# Registers the base weights in memory and makes sure a snapshot exists on disk.
+def register_base(base_model, models_dir):
+    weights = [np.asarray(weight, dtype='float32') for weight in base_model.get_weights()]
+    fingerprint = weights_fingerprint(weights)
+    with _lock:
+        _base_weights[fingerprint] = weights
+    snapshot = os.path.join(_bases_dir(models_dir), fingerprint + ".npz")
+    if not os.path.exists(snapshot):
+        os.makedirs(_bases_dir(models_dir), exist_ok=True)
+        tmp_path = snapshot + f".{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, *weights)
+        os.replace(tmp_path, snapshot)
+    return fingerprint
+
+
+def _get_base_weights(fingerprint, models_dir):
+    with _lock:
+        weights = _base_weights.get(fingerprint)
+    if weights is None:
+        snapshot = os.path.join(_bases_dir(models_dir), fingerprint + ".npz")
+        if not os.path.exists(snapshot):
+            raise FileNotFoundError(f"Base weights {fingerprint} are missing from {_bases_dir(models_dir)}")
+        with np.load(snapshot) as data:
+            weights = [data[f"arr_{index}"] for index in range(len(data.files))]
+        with _lock:
+            _base_weights[fingerprint] = weights
+    return weights
+
+
+def save_delta(model, filepath, base_model, models_dir):
+    fingerprint = register_base(base_model, models_dir)
+    base_weights = _get_base_weights(fingerprint, models_dir)
+    weights = model.get_weights()
+    if [weight.shape for weight in weights] != [weight.shape for weight in base_weights]:
+        raise ValueError("Model weights do not match the base model architecture")
+    deltas = [np.bitwise_xor(np.ascontiguousarray(weight, dtype='float32').view(np.uint32), base.view(np.uint32))
+              for weight, base in zip(weights, base_weights)]
+    tmp_path = filepath + f".{os.getpid()}.tmp.npz"
+    np.savez_compressed(tmp_path, *deltas, __base__=np.array(fingerprint), **_optimizer_state(model))
+    model_persistence.fsync_path(tmp_path)
+    os.replace(tmp_path, filepath)
+    model_persistence.fsync_path(os.path.dirname(os.path.abspath(filepath)))
+
+
+# Config and variables of the optimizer of a model that has been trained, as arrays of the delta file.
+def _optimizer_state(model):
+    import keras
+    optimizer = getattr(model, 'optimizer', None)
+    if optimizer is None or not optimizer.built:
+        return {}
+    state = {'__optimizer__': np.array(json.dumps(keras.optimizers.serialize(optimizer)))}
+    for index, variable in enumerate(optimizer.variables):
+        state[f"optimizer_{index}"] = np.asarray(variable)
+    return state
+
+
+def _read(filepath):
+    with np.load(filepath) as data:
+        fingerprint = str(data['__base__'])
+        deltas = [data[f"arr_{index}"] for index in range(sum(key.startswith("arr_") for key in data.files))]
+        optimizer_config = json.loads(str(data['__optimizer__'])) if '__optimizer__' in data.files else None
+        optimizer_variables = [data[f"optimizer_{index}"]
+                               for index in range(sum(key.startswith("optimizer_") for key in data.files))]
+    return fingerprint, deltas, optimizer_config, optimizer_variables
+
+
+def _apply_deltas(deltas, fingerprint, models_dir):
+    base_weights = _get_base_weights(fingerprint, models_dir)
+    return [np.bitwise_xor(delta, base.view(np.uint32)).view(np.float32) for delta, base in zip(deltas, base_weights)]
+
+
+def load_delta_weights(filepath, models_dir):
+    fingerprint, deltas, _, _ = _read(filepath)
+    return _apply_deltas(deltas, fingerprint, models_dir)
+
+
+# Rebuilds a full, compiled model from a delta file and the in-memory base model, with the stored optimizer state
+# (deltas written before it was stored get a new Adam optimizer).
+def load_delta(filepath, base_model, models_dir):
+    import keras
+    fingerprint, deltas, optimizer_config, optimizer_variables = _read(filepath)
+    model = keras.models.clone_model(base_model)
+    model.set_weights(_apply_deltas(deltas, fingerprint, models_dir))
+    optimizer = keras.optimizers.deserialize(optimizer_config) if optimizer_config is not None else 'adam'
+    model.compile(optimizer=optimizer, loss='categorical_crossentropy', metrics=['accuracy'])
+    if optimizer_variables:
+        optimizer.build(model.trainable_variables)
+        if [tuple(variable.shape) for variable in optimizer.variables] != \
+                [variable.shape for variable in optimizer_variables]:
+            raise ValueError(f"Optimizer state of {filepath} does not match the model")
+        for variable, value in zip(optimizer.variables, optimizer_variables):
+            variable.assign(value)
+    return model
+
+
+# Converts every student .keras file under models/<class_code>/ into a delta file.
+def migrate(models_dir, base_model):
+    import keras
+    converted = 0
+    for class_code in sorted(os.listdir(models_dir)):
+        class_dir = os.path.join(models_dir, class_code)
+        if class_code.startswith(".") or not os.path.isdir(class_dir):
+            continue
+        for filename in sorted(os.listdir(class_dir)):
+            if not filename.endswith(".keras"):
+                continue
+            keras_path = os.path.join(class_dir, filename)
+            model = keras.models.load_model(keras_path)
+            save_delta(model, delta_path(keras_path), base_model, models_dir)
+            restored = load_delta_weights(delta_path(keras_path), models_dir)
+            if not all(np.array_equal(a, b) for a, b in zip(model.get_weights(), restored)):
+                os.remove(delta_path(keras_path))
+                raise ValueError(f"Delta of {keras_path} does not restore the original weights")
+            os.remove(keras_path)
+            converted += 1
+            print(f"(DS) Migrated {keras_path}")
+    return converted
+
+
+if __name__ == '__main__':
+    import keras
+    directory = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), 'models')
+    base = keras.models.load_model(os.path.join(directory, "curriculum_under_trained_k_folds.keras"))
+    print(f"(DS) {migrate(directory, base)} models migrated.")
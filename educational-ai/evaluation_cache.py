@@ -0,0 +1,88 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sklearn.metrics import confusion_matrix
+
+# Evaluation results per model (metrics, predicted classes and confusion matrix over the test set). An entry is only
+# served while the model file version and the test set it was computed on are unchanged, and it is dropped as soon
+# as the model is saved again.
+
+MAX_ENTRIES = int(os.environ.get('EVALUATION_CACHE_SIZE', 1024))
+
+
+class EvaluationCache:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, name, version, compute):
+        result = self.get(name, version)
+        if result is None:
+            result = compute()
+            self.put(name, version, result)
+        return result
+
+    def get(self, name, version):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry['version'] == version:
+                self._entries.move_to_end(name)
+                self.hits += 1
+                return entry['result']
+            self.misses += 1
+            return None
+
+    def put(self, name, version, result):
+        with self._lock:
+            self._entries[name] = {'version': version, 'result': result}
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, name):
+        with self._lock:
+            self._entries.pop(name, None)
+
+    def invalidate_where(self, predicate):
+        with self._lock:
+            for name in [name for name in self._entries if predicate(name)]:
+                del self._entries[name]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+def dataset_fingerprint(x_test, y_test):
+    digest = hashlib.sha1()
+    for array in (x_test, y_test):
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype}{array.shape}".encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+# Builds every evaluation output from one forward pass. The loss matches model.evaluate: the mean categorical
+# cross-entropy plus the regularization losses of the model.
+def summarize(model, probabilities, y_test):
+    y_test = np.asarray(y_test)
+    clipped = np.clip(probabilities, 1e-7, 1 - 1e-7)
+    loss = float(-np.mean(np.sum(y_test * np.log(clipped), axis=1)))
+    loss += sum(float(regularization) for regularization in getattr(model, 'losses', []))
+    predicted_classes = np.argmax(probabilities, axis=1)
+    true_classes = np.argmax(y_test, axis=1)
+    accuracy = float(np.mean(predicted_classes == true_classes))
+    metric_names = list(getattr(model, 'metrics_names', []))
+    if len(metric_names) != 2:
+        metric_names = ['loss', 'accuracy']
+    return {
+        'metrics': dict(zip(metric_names, [loss, accuracy])),
+        'predicted_classes': predicted_classes.tolist(),
+        'confusion_matrix': confusion_matrix(true_classes, predicted_classes).tolist()
+    }
@@ -0,0 +1,18 @@
+import os
+import shutil
+
+# Loaded by gunicorn from the project folder. The workers (and their training job processes) share their Prometheus
+# metrics through PROMETHEUS_MULTIPROC_DIR, which must be set before they import app and emptied on every start.
+
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.metrics'))
+
+
+def on_starting(server):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    import service_metrics
+    service_metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,103 @@
+import json
+import os
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+
+# Training histories shared by every worker process and kept across restarts. Each training run is one row holding
+# its metrics as a float32 (metrics x epochs) block, so appending epochs is a single insert and reading a model's
+# full history is a single indexed query. Metrics of a run with fewer epochs than the others are padded in the block
+# and trimmed back to their own length on read. Model names are stored without the .keras extension.
+
+DEFAULT_PATH = os.environ.get('HISTORY_DB', os.path.join(os.path.dirname(__file__), 'histories.sqlite3'))
+
+
+def _normalize(name):
+    return name[:-len(".keras")] if name.endswith(".keras") else name
+
+
+class HistoryStore:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        with closing(self._connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""CREATE TABLE IF NOT EXISTS history_chunks (
+                                      model TEXT NOT NULL,
+                                      chunk INTEGER NOT NULL,
+                                      metrics TEXT NOT NULL,
+                                      data BLOB NOT NULL,
+                                      PRIMARY KEY (model, chunk))""")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    # Replaces the whole history of a model.
+    def __setitem__(self, name, history):
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM history_chunks WHERE model = ?", (_normalize(name),))
+            self._insert(connection, _normalize(name), history)
+
+    def __getitem__(self, name):
+        history = self.get(name)
+        if history is None:
+            raise KeyError(name)
+        return history
+
+    def __contains__(self, name):
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT 1 FROM history_chunks WHERE model = ? LIMIT 1",
+                                     (_normalize(name),)).fetchone()
+        return row is not None
+
+    def __delitem__(self, name):
+        self.delete(name)
+
+    # Appends the epochs of a new training run to the history of a model.
+    def append(self, name, history):
+        with closing(self._connect()) as connection, connection:
+            self._insert(connection, _normalize(name), history)
+
+    def delete(self, name):
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM history_chunks WHERE model = ?", (_normalize(name),))
+
+    # Returns {metric: [values per epoch]}, downsampled to at most max_points (>= 1) epochs when requested. NaN values
+    # (e.g. a diverged loss) are returned as None, so the history is valid JSON.
+    def get(self, name, max_points=None):
+        if max_points is not None and max_points < 1:
+            raise ValueError("max_points must be at least 1")
+        with closing(self._connect()) as connection:
+            rows = connection.execute("SELECT metrics, data FROM history_chunks WHERE model = ? ORDER BY chunk",
+                                      (_normalize(name),)).fetchall()
+        if not rows:
+            return None
+        columns = {}
+        for metrics, data in rows:
+            metrics = json.loads(metrics)
+            values = np.frombuffer(data, dtype=np.float32).reshape(len(metrics), -1)
+            for metric, metric_values in zip(metrics, values):
+                # Chunks written before the lengths were stored hold metric names only.
+                metric, length = metric if isinstance(metric, list) else (metric, len(metric_values))
+                columns.setdefault(metric, []).append(metric_values[:length])
+        history = {}
+        for metric, chunks in columns.items():
+            values = np.concatenate(chunks)
+            if max_points and len(values) > max_points:
+                values = values[np.linspace(0, len(values) - 1, max_points).round().astype(int)]
+            history[metric] = [None if np.isnan(value) else value for value in values.tolist()]
+        return history
+
+    @staticmethod
+    def _insert(connection, name, history):
+        metrics = sorted(history)
+        if not metrics:
+            return
+        epochs = max(len(history[metric]) for metric in metrics)
+        data = np.full((len(metrics), epochs), np.nan, dtype=np.float32)
+        for row, metric in enumerate(metrics):
+            data[row, :len(history[metric])] = history[metric]
+        connection.execute("""INSERT INTO history_chunks (model, chunk, metrics, data)
+                              SELECT ?, COALESCE(MAX(chunk) + 1, 0), ?, ? FROM history_chunks WHERE model = ?""",
+                           (name, json.dumps([[metric, len(history[metric])] for metric in metrics]), data.tobytes(),
+                            name))
@@ -0,0 +1,124 @@
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import socket
+
+import numpy as np
+
+import parallel_folds
+
+# Persistent, resumable hyperparameter search. Every search lives in tuning/<project>_<key>/, where the key hashes the
+# hypermodel source, the search settings and the training data, and the tuner never overwrites it: an interrupted
+# search resumes from its saved trials, and a finished one leaves best_hyperparameters.json behind, so a reset with
+# unchanged data rebuilds the best model without searching again. With HP_SEARCH_WORKERS > 1 the trials run on local
+# worker processes coordinated by a chief oracle process (keras_tuner distributed mode).
+
+TUNING_DIR = os.environ.get('TUNING_DIR', os.path.join(os.path.dirname(__file__), 'tuning'))
+SEARCH_WORKERS = int(os.environ.get('HP_SEARCH_WORKERS', 1))
+BEST_HPS_FILE = "best_hyperparameters.json"
+
+
+def search_key(hypermodel, stages, settings):
+    digest = hashlib.sha1()
+    digest.update(f"{hypermodel.__module__}.{hypermodel.__qualname__}".encode())
+    digest.update(inspect.getsource(hypermodel).encode())
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    for x, y, epochs in stages:
+        for array in (x, y):
+            array = np.ascontiguousarray(array)
+            digest.update(f"{array.dtype}{array.shape}".encode())
+            digest.update(array.tobytes())
+        digest.update(str(epochs).encode())
+    return digest.hexdigest()[:16]
+
+
+def load_best_hyperparameters(project_dir):
+    from keras_tuner import HyperParameters
+    try:
+        with open(os.path.join(project_dir, BEST_HPS_FILE)) as hps_file:
+            return HyperParameters.from_config(json.load(hps_file)['hyperparameters'])
+    except FileNotFoundError:
+        return None
+
+
+def save_best_hyperparameters(project_dir, key, hypermodel, hyperparameters):
+    tmp_path = os.path.join(project_dir, f"{BEST_HPS_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as hps_file:
+        json.dump({'key': key, 'hypermodel': hypermodel.__qualname__, 'values': hyperparameters.values,
+                   'hyperparameters': hyperparameters.get_config()}, hps_file)
+    os.replace(tmp_path, os.path.join(project_dir, BEST_HPS_FILE))
+
+
+# Searches the best hyperparameters of the hypermodel, running one tuner.search per stage, each stage being
+# (x_train, y_train, epochs). Returns the model built with them and the hyperparameters.
+def search(hypermodel, project_name, stages, max_trials=1, validation_split=0.30, workers=SEARCH_WORKERS):
+    settings = {'objective': 'val_accuracy', 'max_trials': max_trials, 'validation_split': validation_split}
+    key = search_key(hypermodel, stages, settings)
+    directory = os.path.join(TUNING_DIR, f"{project_name}_{key}")
+    project_dir = os.path.join(directory, project_name)
+    hyperparameters = load_best_hyperparameters(project_dir)
+    if hyperparameters is not None:
+        print(f"(HP) Reusing the best HP of {project_name} for unchanged data ({key}) ...")
+        return hypermodel(hyperparameters), hyperparameters
+
+    os.makedirs(directory, exist_ok=True)
+    search_args = (hypermodel, directory, project_name, max_trials, validation_split)
+    if workers > 1:
+        for stage in stages:
+            _run_distributed(workers, search_args, [stage])
+    else:
+        _run_search(*search_args, stages)
+    tuner = _make_tuner(hypermodel, directory, project_name, max_trials)
+    print(tuner.results_summary())
+    hyperparameters = tuner.get_best_hyperparameters()[0]
+    save_best_hyperparameters(project_dir, key, hypermodel, hyperparameters)
+    return tuner.hypermodel.build(hyperparameters), hyperparameters
+
+
+def _make_tuner(hypermodel, directory, project_name, max_trials):
+    from keras_tuner import BayesianOptimization
+    return BayesianOptimization(
+        hypermodel=hypermodel,
+        objective='val_accuracy',
+        max_trials=max_trials,
+        executions_per_trial=1,
+        directory=directory,
+        project_name=project_name,
+        overwrite=False)
+
+
+def _run_search(hypermodel, directory, project_name, max_trials, validation_split, stages):
+    import tensorflow as tf
+    tuner = _make_tuner(hypermodel, directory, project_name, max_trials)
+    for x_train, y_train, epochs in stages:
+        stop_early = tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=2)
+        tuner.search(x_train, y_train, validation_split=validation_split, epochs=epochs, callbacks=[stop_early])
+
+
+# Entry point of the chief and worker processes of a distributed search.
+def _search_process(tuner_id, port, threads, search_args, stages):
+    os.environ['KERASTUNER_TUNER_ID'] = tuner_id
+    os.environ['KERASTUNER_ORACLE_IP'] = '127.0.0.1'
+    os.environ['KERASTUNER_ORACLE_PORT'] = str(port)
+    parallel_folds.limit_threads(threads)
+    _run_search(*search_args, stages)
+
+
+def _run_distributed(workers, search_args, stages):
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # TensorFlow is not fork-safe, so the processes are spawned as fresh interpreters.
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_search_process, args=(tuner_id, port, threads, search_args, stages))
+                 for tuner_id in ['chief'] + [f"tuner{index}" for index in range(workers)]]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    failed = [process.exitcode for process in processes if process.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"Hyperparameter search processes failed with exit codes {failed}")
@@ -0,0 +1,101 @@
+import math
+
+import numpy as np
+
+# Shared input pipeline for training. The samples of every training stage live in one preallocated,
+# difficulty-ordered array, and stages, validation splits and folds are plain index arrays into it. tf.data datasets
+# gather the batches from that array, so no stage or fold is ever materialized as a copy of the samples.
+#
+# Curriculum stages are usually prefixes of each other (x_train0, x_increment_01 and x_increment_012), so they all
+# map onto ranges of the longest one. Stacked curriculum stages keep the samples repeated the way np.vstack did, by
+# concatenating the index ranges of the stages.
+
+BATCH_SIZE = 32
+
+
+class TrainingData:
+    def __init__(self, x, y, ranges):
+        self.x = x
+        self.y = y
+        # (start, end) range of every stage in x and y.
+        self.ranges = ranges
+        self._tensors = None
+
+    # Builds the shared arrays from the stage arrays: a stage that is a prefix of the longest stage is a range of it,
+    # any other stage is appended after it.
+    @classmethod
+    def from_stages(cls, x_list, y_list):
+        if len(x_list) != len(y_list):
+            raise Exception("x_train and y_train dataSet lists must match in size.")
+        longest = max(range(len(x_list)), key=lambda stage: len(x_list[stage]))
+        base_x, base_y = x_list[longest], y_list[longest]
+        ranges, extra = [], []
+        size = len(base_x)
+        for x, y in zip(x_list, y_list):
+            if len(x) <= len(base_x) and np.array_equal(base_x[:len(x)], x) and np.array_equal(base_y[:len(y)], y):
+                ranges.append((0, len(x)))
+            else:
+                ranges.append((size, size + len(x)))
+                extra.append((size, size + len(x), x, y))
+                size += len(x)
+        x = np.empty((size,) + np.shape(base_x)[1:], dtype='float32')
+        y = np.empty((size,) + np.shape(base_y)[1:], dtype='float32')
+        x[:len(base_x)], y[:len(base_y)] = base_x, base_y
+        for start, end, stage_x, stage_y in extra:
+            x[start:end], y[start:end] = stage_x, stage_y
+        return cls(x, y, ranges)
+
+    def __getstate__(self):
+        # Tensors are rebuilt lazily, e.g. after being sent to a fold worker process.
+        return {'x': self.x, 'y': self.y, 'ranges': self.ranges, '_tensors': None}
+
+    def stage_indices(self, stage):
+        return np.arange(*self.ranges[stage], dtype='int32')
+
+    # Indices of the curriculum stages 0..stage stacked one after another.
+    def stacked_indices(self, stage):
+        return np.concatenate([self.stage_indices(index) for index in range(stage + 1)])
+
+    def labels(self, indices):
+        return np.argmax(self.y[indices], axis=1)
+
+    def dataset(self, indices, batch_size=BATCH_SIZE, shuffle=True, cache=False):
+        import tensorflow as tf
+        if self._tensors is None:
+            self._tensors = (tf.constant(self.x[..., np.newaxis]), tf.constant(self.y))
+        x, y = self._tensors
+        dataset = tf.data.Dataset.from_tensor_slices(np.asarray(indices, dtype='int32'))
+        if shuffle:
+            dataset = dataset.shuffle(len(indices), reshuffle_each_iteration=True)
+        dataset = dataset.batch(batch_size).map(lambda batch: (tf.gather(x, batch), tf.gather(y, batch)),
+                                                num_parallel_calls=tf.data.AUTOTUNE)
+        if cache:
+            dataset = dataset.cache()
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+    # Training and validation datasets for the given indices, with the validation set being the last fraction of the
+    # samples taken before shuffling, as Keras does for validation_split. The validation dataset is None when
+    # validation_split is 0.
+    def split_datasets(self, indices, validation_split, batch_size=BATCH_SIZE):
+        train_indices, val_indices = split_validation(indices, validation_split)
+        if not len(val_indices):
+            return self.dataset(train_indices, batch_size), None
+        return self.dataset(train_indices, batch_size), \
+            self.dataset(val_indices, batch_size, shuffle=False, cache=True)
+
+    # Training and validation datasets of one fold, given positions inside the indices (as yielded by
+    # StratifiedKFold.split).
+    def fold_datasets(self, indices, train_positions, val_positions, batch_size=BATCH_SIZE):
+        return self.dataset(indices[train_positions], batch_size), \
+            self.dataset(indices[val_positions], batch_size, shuffle=False, cache=True)
+
+
+# Like Keras, validation_split=0 means no validation, and any other split must leave samples on both sides.
+def split_validation(indices, validation_split):
+    if not validation_split:
+        return indices, indices[:0]
+    split_at = int(math.floor(len(indices) * (1.0 - validation_split)))
+    if split_at == 0 or split_at == len(indices):
+        raise ValueError(f"validation_split={validation_split} leaves no training or validation samples for "
+                         f"{len(indices)} samples.")
+    return indices[:split_at], indices[split_at:]
@@ -0,0 +1,193 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import lock_utils
+import service_metrics
+
+# Background training jobs. Work runs on a bounded pool of local worker processes and every job keeps its state in
+# jobs/<job_id>.json, so any gunicorn worker can answer status requests. Jobs take the training lock of the models
+# they train, which guarantees that two jobs never train the same model at the same time. Every gunicorn worker has a
+# pool of its own, so jobs also take one of TRAINING_WORKERS slot locks in jobs/.slots/ first: at most
+# TRAINING_WORKERS jobs train at a time across all workers, and the others wait in the 'waiting' status.
+
+JOBS_DIR = os.path.join(os.path.dirname(__file__), 'jobs')
+MAX_WORKERS = int(os.environ.get('TRAINING_WORKERS', 1))
+# Finished jobs older than this are removed from the job store (seconds).
+JOB_TTL = int(os.environ.get('TRAINING_JOB_TTL', 24 * 60 * 60))
+
+
+def _job_path(job_id, jobs_dir=JOBS_DIR):
+    return os.path.join(jobs_dir, f"{job_id}.json")
+
+
+def read_job(job_id, jobs_dir=JOBS_DIR):
+    try:
+        with open(_job_path(job_id, jobs_dir)) as job_file:
+            return json.load(job_file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_job(job, jobs_dir=JOBS_DIR):
+    os.makedirs(jobs_dir, exist_ok=True)
+    tmp_path = _job_path(job['id'], jobs_dir) + f".{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as job_file:
+        json.dump(job, job_file, default=_to_json)
+    os.replace(tmp_path, _job_path(job['id'], jobs_dir))
+
+
+def update_job(job_id, jobs_dir=JOBS_DIR, **fields):
+    job = read_job(job_id, jobs_dir)
+    if job is None:
+        return
+    job.update(fields)
+    write_job(job, jobs_dir)
+
+
+def _to_json(value):
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+class ProgressReporter:
+    def __init__(self, job_id, jobs_dir=JOBS_DIR):
+        self.job_id = job_id
+        self.jobs_dir = jobs_dir
+
+    def __call__(self, **progress):
+        update_job(self.job_id, self.jobs_dir, progress=progress)
+
+    # Keras callback reporting the last finished epoch and its metrics.
+    def keras_callback(self, stage=None):
+        import tensorflow as tf
+        reporter = self
+
+        class JobProgressCallback(tf.keras.callbacks.Callback):
+            def on_epoch_end(self, epoch, logs=None):
+                reporter(stage=stage, epoch=epoch + 1, epochs=self.params.get('epochs'),
+                         logs={key: float(value) for key, value in (logs or {}).items()})
+
+        return JobProgressCallback()
+
+
+# Entry point executed in the worker process. The slot is taken before the model locks, so a job waiting for a slot
+# never holds a model lock.
+def run_job(job_id, jobs_dir, target, args, model_names, slots=MAX_WORKERS):
+    update_job(job_id, jobs_dir, status='waiting')
+    try:
+        with lock_utils.slot_lock(os.path.join(jobs_dir, '.slots'), slots), lock_utils.model_locks(model_names):
+            update_job(job_id, jobs_dir, status='running', started_at=time.time())
+            result = target(*args, progress=ProgressReporter(job_id, jobs_dir))
+        update_job(job_id, jobs_dir, status='finished', result=result, finished_at=time.time())
+    except Exception as e:
+        update_job(job_id, jobs_dir, status='failed', error=str(e), traceback=traceback.format_exc(),
+                   finished_at=time.time())
+
+
+class JobManager:
+    def __init__(self, max_workers=MAX_WORKERS, jobs_dir=JOBS_DIR):
+        self.max_workers = max_workers
+        self.jobs_dir = jobs_dir
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # TensorFlow is not fork-safe, so workers are spawned as fresh interpreters.
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    # on_finished(job) is called in this process once the job has finished successfully.
+    def submit(self, kind, target, args, model_names, on_finished=None):
+        self.prune()
+        job = {
+            'id': uuid.uuid4().hex,
+            'kind': kind,
+            'models': list(model_names),
+            'status': 'queued',
+            'progress': None,
+            'result': None,
+            'error': None,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None
+        }
+        write_job(job, self.jobs_dir)
+        service_metrics.TRAINING_JOBS_ACTIVE.labels(kind).inc()
+        future = self._get_executor().submit(run_job, job['id'], self.jobs_dir, target, args, list(model_names),
+                                             self.max_workers)
+        future.add_done_callback(lambda done: self._on_done(job['id'], done, on_finished, kind))
+        return job
+
+    # Marks jobs whose worker process died before it could record the outcome.
+    def _on_done(self, job_id, future, on_finished=None, kind=None):
+        service_metrics.TRAINING_JOBS_ACTIVE.labels(kind).dec()
+        if future.exception() is not None:
+            update_job(job_id, self.jobs_dir, status='failed', error=str(future.exception()),
+                       finished_at=time.time())
+            return
+        job = read_job(job_id, self.jobs_dir)
+        if on_finished is not None and job is not None and job['status'] == 'finished':
+            on_finished(job)
+
+    def get(self, job_id):
+        return read_job(job_id, self.jobs_dir)
+
+    def prune(self):
+        if not os.path.isdir(self.jobs_dir):
+            return
+        limit = time.time() - JOB_TTL
+        for filename in os.listdir(self.jobs_dir):
+            job = read_job(os.path.splitext(filename)[0], self.jobs_dir) if filename.endswith('.json') else None
+            if job and job['finished_at'] and job['finished_at'] < limit:
+                os.remove(_job_path(job['id'], self.jobs_dir))
+
+    def shutdown(self, wait=False):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+# Job targets, run inside the worker processes.
+def teach_job(model_name, words, tokenizer, padding, progress):
+    import usecase
+    result, mistakes = usecase.teach(model_name, words, tokenizer, padding, callbacks=[progress.keras_callback()])
+    # The job releases the model lock when it returns, so the model must be on disk by then.
+    usecase.model_writer.flush([model_name])
+    return {'mistakes': mistakes.tolist(), 'history': result.history}
+
+
+def reset_job(x, y, x_train, y_train, x_train0, y_train0, x_increment_01, y_increment_01, x_increment_012,
+              y_increment_012, models_missing, progress):
+    import usecase
+    usecase.reset(x, y, x_train, y_train, x_train0, y_train0, x_increment_01, y_increment_01, x_increment_012,
+                  y_increment_012, models_missing, progress=progress)
+    usecase.model_writer.flush()
+    return {'message': 'Models have been reset and retrained successfully.'}
+
+
+# Trains the missing default models once. Every worker may submit it at startup; only the holder of the provisioning
+# lock trains, and it checks again which models are missing once it owns the lock.
+def provision_job(x, y, x_train, y_train, x_train0, y_train0, x_increment_01, y_increment_01, x_increment_012,
+                  y_increment_012, default_models, models_dir, progress):
+    import usecase
+    with lock_utils.file_lock(os.path.join(models_dir, '.locks', 'provision.lock'), blocking=False) as acquired:
+        if not acquired:
+            return {'message': 'Default models are being provisioned by another process.', 'trained': []}
+        models_missing = [model for model in default_models if not os.path.exists(os.path.join(models_dir, model))]
+        if models_missing:
+            with lock_utils.model_locks(models_missing):
+                usecase.reset(x, y, x_train, y_train, x_train0, y_train0, x_increment_01, y_increment_01,
+                              x_increment_012, y_increment_012, models_missing, progress=progress)
+                usecase.model_writer.flush()
+        return {'message': 'Default models are available.', 'trained': models_missing}
@@ -0,0 +1,126 @@
+import fcntl
+import os
+import time
+from contextlib import contextmanager, ExitStack
+
+# Seconds a process holding the training lock of a model waits for another process to write its pending save of it.
+PENDING_SAVE_TIMEOUT = float(os.environ.get('MODEL_PENDING_SAVE_TIMEOUT', 60))
+
+
+# Cross-process lock backed by fcntl.flock on a lock file. Yields False when blocking=False and the lock is taken.
+@contextmanager
+def file_lock(path, blocking=True):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as lock_file:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def model_lock_path(model_name, directory="models/"):
+    if model_name.endswith(".keras"):
+        model_name = model_name[:-len(".keras")]
+    return os.path.join(os.path.dirname(__file__), directory, ".locks", model_name + ".lock")
+
+
+def _model_name(model_name):
+    return model_name[:-len(".keras")] if model_name.endswith(".keras") else model_name
+
+
+# Holds the training lock of every given model; names are sorted so that concurrent holders cannot deadlock. Once it
+# holds them, it waits for the pending saves other processes still keep in memory, so the holder always trains and
+# saves on top of the latest weights.
+@contextmanager
+def model_locks(model_names):
+    model_names = sorted({_model_name(model_name) for model_name in model_names})
+    with ExitStack() as stack:
+        for model_name in model_names:
+            stack.enter_context(file_lock(model_lock_path(model_name)))
+        for model_name in model_names:
+            wait_for_pending_save(model_name)
+        yield
+
+
+# A write-behind save (model_persistence) leaves a marker with the pid of the process whose memory holds the latest
+# weights of the model until they are written. Other processes ask it to write them with a flush request file, which
+# only ever exists while the training lock is held by the process waiting for that write.
+def pending_save_path(model_name, directory="models/"):
+    return os.path.splitext(model_lock_path(model_name, directory))[0] + ".pending"
+
+
+def flush_request_path(model_name, directory="models/"):
+    return os.path.splitext(model_lock_path(model_name, directory))[0] + ".flush"
+
+
+def pending_save_owner(model_name):
+    try:
+        with open(pending_save_path(model_name)) as marker_file:
+            return int(marker_file.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def mark_pending_save(model_name):
+    path = pending_save_path(model_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as marker_file:
+        marker_file.write(str(os.getpid()))
+
+
+def clear_pending_save(model_name):
+    for path in (pending_save_path(model_name), flush_request_path(model_name)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Called with the training lock of the model held: while another (live) process has a pending save of the model, asks
+# it to write the save and waits until it has.
+def wait_for_pending_save(model_name, timeout=PENDING_SAVE_TIMEOUT, poll_interval=0.02):
+    deadline = time.monotonic() + timeout
+    request_path = flush_request_path(model_name)
+    try:
+        while True:
+            owner = pending_save_owner(model_name)
+            if owner is None or owner == os.getpid():
+                return
+            if not _process_alive(owner):
+                clear_pending_save(model_name)
+                return
+            open(request_path, 'a').close()
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Process {owner} did not write its pending save of {model_name} in {timeout}s")
+            time.sleep(poll_interval)
+    finally:
+        if os.path.exists(request_path):
+            os.remove(request_path)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Cross-process semaphore: holds one of `slots` lock files in directory, waiting until one of them is free.
+@contextmanager
+def slot_lock(directory, slots, poll_interval=0.5):
+    while True:
+        for slot in range(max(1, slots)):
+            with file_lock(os.path.join(directory, f"{slot}.lock"), blocking=False) as acquired:
+                if acquired:
+                    yield slot
+                    return
+        time.sleep(poll_interval)
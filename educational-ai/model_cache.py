@@ -0,0 +1,112 @@
+import os
+import threading
+from collections import OrderedDict
+
+import service_metrics
+
+# Default memory budget for the loaded models kept in memory (bytes).
+DEFAULT_MAX_BYTES = int(os.environ.get('MODEL_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+
+class ModelCache:
+    # Bounded LRU cache of loaded models keyed by model name. Every entry remembers the mtime and size of the
+    # file it was loaded from, so a model re-saved by another worker is reloaded instead of served stale.
+    # A cached model is shared by every thread of the process, so it is only ever used for inference (predict,
+    # evaluate, exports) and never compiled or fitted in place: training loads an instance of its own
+    # (usecase.get_writable_model), and only copies of trained models are put back.
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, name="keras"):
+        self.max_bytes = max_bytes
+        # Cache label of the metrics, and kind of the model files it reads.
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._current_bytes = 0
+        self._lock = threading.RLock()
+
+    def get(self, name, filepath, loader):
+        signature = file_signature(filepath)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and signature is not None and \
+                    entry['path'] == filepath and entry['signature'] == signature:
+                self._entries.move_to_end(name)
+                self.hits += 1
+                service_metrics.MODEL_CACHE_REQUESTS.labels(self.name, 'hit').inc()
+                return entry['model']
+            self.misses += 1
+        service_metrics.MODEL_CACHE_REQUESTS.labels(self.name, 'miss').inc()
+        model = loader(filepath)
+        service_metrics.bytes_read(self.name, signature[1] if signature is not None else None)
+        self.put(name, model, filepath, signature)
+        return model
+
+    # Stores an in-memory model, e.g. right after it has been saved to disk.
+    def put(self, name, model, filepath, signature=None):
+        if signature is None:
+            signature = file_signature(filepath)
+        size = estimate_model_bytes(model)
+        with self._lock:
+            self._discard(name)
+            if size > self.max_bytes:
+                return
+            self._entries[name] = {'model': model, 'path': filepath, 'signature': signature, 'bytes': size}
+            self._current_bytes += size
+            while self._current_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def invalidate(self, name):
+        with self._lock:
+            self._discard(name)
+
+    # Drops every model whose file lives under the given directory (used when a class is deleted).
+    def invalidate_directory(self, directory):
+        directory = os.path.abspath(directory)
+        with self._lock:
+            for name in [name for name, entry in self._entries.items()
+                         if os.path.abspath(entry['path']).startswith(directory + os.sep)]:
+                self._discard(name)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._current_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+    def _discard(self, name):
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self._current_bytes -= entry['bytes']
+
+
+def file_signature(filepath):
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+# Approximates the memory held by a model with the size of its weights (optimizer slots included).
+def estimate_model_bytes(model):
+    total = sum(weight.nbytes for weight in model.get_weights())
+    optimizer = getattr(model, 'optimizer', None)
+    if optimizer is not None:
+        variables = getattr(optimizer, 'variables', [])
+        if callable(variables):
+            variables = variables()
+        total += sum(int(variable.numpy().nbytes) for variable in variables)
+    return total
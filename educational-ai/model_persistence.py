@@ -0,0 +1,215 @@
+import atexit
+import os
+import threading
+import time
+
+import lock_utils
+
+# Write-behind persistence of trained models. Files are written to a temporary name, flushed to disk and renamed over
+# the target, so readers only ever see complete models. A save is recorded in memory and written by a background
+# thread once the model has not been saved again for SAVE_DELAY seconds (or SAVE_MAX_DELAY seconds after its first
+# pending save), so several teaching rounds in a short window produce a single disk write and the request returns
+# before it. Until then this process serves the pending model from memory; other processes read the previous file,
+# and reload the model once the new one is written (the model caches check the file signature).
+#
+# Across processes, a pending save leaves a marker (lock_utils.mark_pending_save). Every training lock holder waits
+# for the pending saves of other processes before it trains, asking them to write right away with a flush request
+# that the background thread polls every REQUEST_POLL_INTERVAL seconds, so no process trains from an outdated file.
+# A failed background write is kept pending and retried with a growing delay, and flush() raises it. Pending saves
+# are flushed when the process exits. MODEL_SAVE_DELAY=0 writes every save before it returns (write-through) and
+# raises its errors to the caller.
+
+SAVE_DELAY = float(os.environ.get('MODEL_SAVE_DELAY', 2))
+SAVE_MAX_DELAY = float(os.environ.get('MODEL_SAVE_MAX_DELAY', 30))
+REQUEST_POLL_INTERVAL = 0.05
+
+
+# Temporary path next to the target, with the same extension (Keras only saves to .keras paths) and hidden from the
+# model listings.
+def temporary_path(filepath):
+    directory, filename = os.path.split(filepath)
+    return os.path.join(directory, f".{os.getpid()}.{threading.get_ident()}.{filename}")
+
+
+def atomic_save(model, filepath):
+    tmp_path = temporary_path(filepath)
+    try:
+        model.save(tmp_path)
+        fsync_path(tmp_path)
+        os.replace(tmp_path, filepath)
+        fsync_path(os.path.dirname(os.path.abspath(filepath)))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# Flushes a file, or the entries of a directory, to disk.
+def fsync_path(path):
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+class ModelWriter:
+    def __init__(self, delay=SAVE_DELAY, max_delay=SAVE_MAX_DELAY):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.writes = 0
+        self.coalesced = 0
+        self.failures = 0
+        # Last error of the models whose latest write failed: {name: message}.
+        self.errors = {}
+        self._pending = {}
+        self._writing = set()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    # Records a save of the model; write() performs it. on_written() runs once the file is on disk. In write-through
+    # mode the save is written right away and its errors are raised to the caller.
+    def schedule(self, name, model, write, on_written=None):
+        entry = {'model': model, 'write': write, 'on_written': on_written, 'attempts': 0, 'retry_at': 0}
+        if self.delay <= 0:
+            try:
+                self._write(name, entry)
+            except Exception as e:
+                self._record_failure(name, e)
+                raise
+            return
+        lock_utils.mark_pending_save(name)
+        now = time.monotonic()
+        with self._condition:
+            previous = self._pending.get(name)
+            if previous is not None:
+                self.coalesced += 1
+                # A newer save of a model whose write keeps failing waits for the same retry.
+                entry.update(attempts=previous['attempts'], retry_at=previous['retry_at'])
+            self._pending[name] = dict(entry, first=previous['first'] if previous else now, last=now)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                # Registered with the first pending save, after the libraries the writes use (Keras and h5py are
+                # imported lazily): exit handlers run last-registered first, and theirs would close them before it.
+                atexit.register(self.flush)
+            self._condition.notify_all()
+
+    # Model saved but not yet written, served in place of the file on disk.
+    def pending_model(self, name):
+        with self._condition:
+            entry = self._pending.get(name)
+            return entry['model'] if entry is not None else None
+
+    def pending(self):
+        with self._condition:
+            return sorted(self._pending)
+
+    # Writes the pending saves (all of them, or those of the given names) in the calling thread, and waits for the
+    # ones the background thread is writing. Saves that fail stay pending, and the first error is raised.
+    def flush(self, names=None):
+        with self._condition:
+            targets = set(self._pending) | self._writing if names is None else set(names)
+            entries = [(name, self._pending.pop(name)) for name in targets if name in self._pending]
+            self._writing.update(name for name, _ in entries)
+        errors = []
+        try:
+            for name, entry in entries:
+                try:
+                    self._write(name, entry)
+                except Exception as e:
+                    self._retry_later(name, entry, e)
+                    errors.append(e)
+        finally:
+            with self._condition:
+                self._writing.difference_update(name for name, _ in entries)
+                self._condition.notify_all()
+                self._condition.wait_for(lambda: not self._writing.intersection(targets))
+        if errors:
+            raise errors[0]
+
+    def flush_where(self, predicate):
+        with self._condition:
+            names = [name for name in set(self._pending) | self._writing if predicate(name)]
+        self.flush(names)
+
+    # Drops the pending save of a model that is being deleted. Returns whether there was one.
+    def cancel(self, name):
+        with self._condition:
+            entry = self._pending.pop(name, None)
+            self.errors.pop(name, None)
+            self._condition.wait_for(lambda: name not in self._writing)
+        if entry is not None:
+            lock_utils.clear_pending_save(name)
+        return entry is not None
+
+    def stats(self):
+        with self._condition:
+            return {'pending': len(self._pending), 'writes': self.writes, 'coalesced': self.coalesced,
+                    'failures': self.failures, 'errors': dict(self.errors)}
+
+    def _write(self, name, entry):
+        entry['write']()
+        with self._condition:
+            self.writes += 1
+            self.errors.pop(name, None)
+            written = name not in self._pending
+        if entry['on_written'] is not None:
+            entry['on_written']()
+        if written and self.delay > 0:
+            lock_utils.clear_pending_save(name)
+
+    def _record_failure(self, name, error):
+        with self._condition:
+            self.failures += 1
+            self.errors[name] = f"{type(error).__name__}: {error}"
+        print(f"(MP) Saving {name} failed: {error}")
+
+    # Puts a save whose write failed back in the queue, unless a newer save of the model replaced it meanwhile.
+    def _retry_later(self, name, entry, error):
+        self._record_failure(name, error)
+        now = time.monotonic()
+        with self._condition:
+            if name in self._pending:
+                return
+            attempts = entry['attempts'] + 1
+            self._pending[name] = dict(entry, attempts=attempts, first=now, last=now,
+                                       retry_at=now + min(self.max_delay, max(self.delay, 1) * 2 ** attempts))
+            self._condition.notify_all()
+
+    # Saves to write now: idle or old enough, or requested by another process.
+    def _due(self, now):
+        return [name for name, entry in self._pending.items() if now >= entry['retry_at'] and
+                (now - entry['last'] >= self.delay or now - entry['first'] >= self.max_delay or
+                 os.path.exists(lock_utils.flush_request_path(name)))]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+                due = self._due(time.monotonic())
+            written = [self._write_pending(name) for name in due]
+            if not all(written) or not written:
+                with self._condition:
+                    self._condition.wait(timeout=min(self.delay / 2, REQUEST_POLL_INTERVAL))
+
+    # Writes a due save under the training lock of the model, so a round of this process never changes it mid-write.
+    # A flush request means the lock is held by another process waiting for this very save, so it is written for it.
+    # Returns False when the lock is held by a round of this process.
+    def _write_pending(self, name):
+        with lock_utils.file_lock(lock_utils.model_lock_path(name), blocking=False) as acquired:
+            if not acquired and not os.path.exists(lock_utils.flush_request_path(name)):
+                return False
+            with self._condition:
+                entry = self._pending.pop(name, None)
+                if entry is None:
+                    return True
+                self._writing.add(name)
+            try:
+                self._write(name, entry)
+            except Exception as e:
+                self._retry_later(name, entry, e)
+            finally:
+                with self._condition:
+                    self._writing.discard(name)
+                    self._condition.notify_all()
+        return True
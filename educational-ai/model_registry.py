@@ -0,0 +1,220 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import closing
+
+# Index of every stored model, so listings, lookups and class operations are indexed queries instead of directory
+# scans. Rows are kept up to date by usecase (save, delete, new student, class deletion) and shared by every worker
+# through SQLite. Each row holds the class code, student and timestamp parsed from the student model name
+# (<student>_<class_code>_<timestamp>), the stored file and its size, a weight version bumped by every save, and the
+# last time the model was used (recorded at most once per TOUCH_INTERVAL seconds per model and process). Students
+# created by load_new and never taught are lazy: they have no file of their own, and their row names the base model
+# that serves them until their first save.
+
+DEFAULT_PATH = os.environ.get('MODEL_REGISTRY_DB',
+                              os.path.join(os.path.dirname(__file__), 'models', '.registry.sqlite3'))
+TOUCH_INTERVAL = float(os.environ.get('MODEL_REGISTRY_TOUCH_INTERVAL', 60))
+MAX_PAGE_SIZE = 1000
+MODEL_EXTENSIONS = ('.delta.npz', '.keras')
+COLUMNS = ('name', 'class_code', 'student', 'timestamp', 'path', 'size', 'version', 'saved_at', 'last_used',
+           'archived', 'base')
+
+
+# Student models are named <student>_<class_code>_<timestamp>, where the timestamp is the creation time written by the
+# frontend (e.g. juan_ABC_20241002T153012) and kept as text; default models (e.g. max_k_folds,
+# curriculum_under_trained) have no digits in their name. This is the one parser of model names: usecase files, caches
+# and class operations all rely on it.
+def parse_model_name(name):
+    for extension in MODEL_EXTENSIONS:
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    parts = name.split("_")
+    if len(parts) == 3 and any(character.isdigit() for character in name):
+        return parts[0], parts[1], parts[2]
+    return None, None, None
+
+
+class ModelRegistry:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._touched = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""CREATE TABLE IF NOT EXISTS models (
+                                      name TEXT PRIMARY KEY,
+                                      class_code TEXT,
+                                      student TEXT,
+                                      timestamp TEXT,
+                                      path TEXT NOT NULL,
+                                      size INTEGER,
+                                      version INTEGER NOT NULL DEFAULT 1,
+                                      saved_at REAL,
+                                      last_used REAL,
+                                      archived INTEGER NOT NULL DEFAULT 0,
+                                      base TEXT)""")
+            columns = {row['name'] for row in connection.execute("PRAGMA table_info(models)").fetchall()}
+            if 'base' not in columns:
+                connection.execute("ALTER TABLE models ADD COLUMN base TEXT")
+            connection.execute("CREATE INDEX IF NOT EXISTS models_class ON models (class_code, archived, name)")
+            # Students indexed as default models by the parser that only accepted numeric timestamps.
+            for row in connection.execute("SELECT name FROM models WHERE class_code IS NULL").fetchall():
+                student, class_code, timestamp = parse_model_name(row['name'])
+                if class_code is not None:
+                    connection.execute("UPDATE models SET student = ?, class_code = ?, timestamp = ? WHERE name = ?",
+                                       (student, class_code, timestamp, row['name']))
+            connection.execute("CREATE INDEX IF NOT EXISTS models_student ON models (student)")
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    # Records a model file that has just been written, bumping its weight version.
+    def register(self, name, path):
+        with closing(self._connect()) as connection, connection:
+            _upsert(connection, name, path, time.time())
+
+    # Records a lazy student served by the base model stored at base_path.
+    def register_lazy(self, name, base, base_path):
+        student, class_code, timestamp = parse_model_name(name)
+        now = time.time()
+        with closing(self._connect()) as connection, connection:
+            connection.execute("""INSERT INTO models (name, class_code, student, timestamp, path, size, saved_at,
+                                                      last_used, archived, base)
+                                  VALUES (?, ?, ?, ?, ?, 0, ?, ?, 0, ?)
+                                  ON CONFLICT (name) DO UPDATE SET
+                                      path = excluded.path, size = 0, saved_at = excluded.saved_at,
+                                      version = version + 1, archived = 0, base = excluded.base""",
+                               (name, class_code, student, timestamp, os.path.abspath(base_path), now, now, base))
+
+    # Names of the lazy students (of every class still in use) served by the base model.
+    def lazy_names(self, base):
+        with closing(self._connect()) as connection:
+            rows = connection.execute("SELECT name FROM models WHERE base = ? AND archived = 0 ORDER BY name",
+                                      (base,)).fetchall()
+        return [row['name'] for row in rows]
+
+    def remove(self, name):
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM models WHERE name = ?", (name,))
+
+    # Marks the models of a class as archived after its directory has been moved to new_dir. Lazy students keep
+    # pointing at their base model, which has not moved.
+    def archive_class(self, class_code, new_dir):
+        new_dir = os.path.abspath(new_dir)
+        with closing(self._connect()) as connection, connection:
+            rows = connection.execute("SELECT name, path, base FROM models WHERE class_code = ? AND archived = 0",
+                                      (class_code,)).fetchall()
+            connection.executemany("UPDATE models SET archived = 1, path = ? WHERE name = ?",
+                                   [(row['path'] if row['base'] is not None else
+                                     os.path.join(new_dir, os.path.basename(row['path'])), row['name'])
+                                    for row in rows])
+        return len(rows)
+
+    # Records that the model has been used.
+    def touch(self, name):
+        now = time.time()
+        with self._lock:
+            if now - self._touched.get(name, 0) < TOUCH_INTERVAL:
+                return
+            self._touched[name] = now
+        with closing(self._connect()) as connection, connection:
+            connection.execute("UPDATE models SET last_used = ? WHERE name = ?", (now, name))
+
+    def get(self, name):
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT * FROM models WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def names(self, class_code):
+        with closing(self._connect()) as connection:
+            rows = connection.execute("SELECT name FROM models WHERE class_code = ? AND archived = 0 ORDER BY name",
+                                      (class_code,)).fetchall()
+        return [row['name'] for row in rows]
+
+    # Returns one page of models (every matching model when limit is None) and the total number of matching models.
+    def list(self, class_code=None, student=None, archived=False, defaults=None, limit=100, offset=0,
+             order_by='name'):
+        if order_by not in COLUMNS:
+            raise ValueError(f"order_by must be one of {COLUMNS}")
+        conditions, parameters = ["archived = ?"], [int(archived)]
+        if class_code is not None:
+            conditions.append("class_code = ?")
+            parameters.append(class_code)
+        if student is not None:
+            conditions.append("student = ?")
+            parameters.append(student)
+        if defaults is not None:
+            conditions.append("class_code IS NULL" if defaults else "class_code IS NOT NULL")
+        where = " AND ".join(conditions)
+        page, page_parameters = "", []
+        if limit is not None:
+            page, page_parameters = " LIMIT ? OFFSET ?", [max(0, min(limit, MAX_PAGE_SIZE)), max(0, offset)]
+        with closing(self._connect()) as connection:
+            total = connection.execute(f"SELECT COUNT(*) FROM models WHERE {where}", parameters).fetchone()[0]
+            rows = connection.execute(f"SELECT * FROM models WHERE {where} ORDER BY {order_by}, name{page}",
+                                      parameters + page_parameters).fetchall()
+        return [dict(row) for row in rows], total
+
+    def count(self):
+        with closing(self._connect()) as connection:
+            return connection.execute("SELECT COUNT(*) FROM models").fetchone()[0]
+
+    # Indexes every model file under models_dir: default models at its root, students in <class_code>/ and
+    # archived students in <class_code>_deleted/. Rows of files that no longer exist are removed, except those of the
+    # lazy students, which have no file of their own.
+    def rebuild(self, models_dir):
+        found = {}
+        for root, directories, files in os.walk(models_dir):
+            directories[:] = [directory for directory in directories if not directory.startswith('.')]
+            archived = os.path.basename(root).endswith('_deleted')
+            for filename in files:
+                if filename.startswith('.'):
+                    continue
+                for extension in MODEL_EXTENSIONS:
+                    if filename.endswith(extension):
+                        found[filename[:-len(extension)]] = (os.path.join(root, filename), archived)
+                        break
+        with closing(self._connect()) as connection, connection:
+            known = {row['name'] for row in connection.execute("SELECT name FROM models").fetchall()}
+            lazy = {row['name'] for row in connection.execute("SELECT name FROM models WHERE base IS NOT NULL")}
+            connection.executemany("DELETE FROM models WHERE name = ?",
+                                   [(name,) for name in known - set(found) - lazy])
+            for name, (path, archived) in found.items():
+                if name not in known:
+                    _upsert(connection, name, path, os.path.getmtime(path), archived)
+                else:
+                    connection.execute("UPDATE models SET archived = ?, path = ?, size = ?, base = NULL WHERE name = ?",
+                                       (int(archived), os.path.abspath(path), _file_size(path), name))
+        return len(found)
+
+
+def _upsert(connection, name, path, saved_at, archived=False):
+    student, class_code, timestamp = parse_model_name(name)
+    connection.execute("""INSERT INTO models (name, class_code, student, timestamp, path, size, saved_at, last_used,
+                                              archived)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                          ON CONFLICT (name) DO UPDATE SET
+                              path = excluded.path, size = excluded.size, saved_at = excluded.saved_at,
+                              version = version + 1, archived = excluded.archived, base = NULL""",
+                       (name, class_code, student, timestamp, os.path.abspath(path), _file_size(path), saved_at,
+                        saved_at, int(archived)))
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+if __name__ == '__main__':
+    models_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), 'models')
+    print(f"(MR) Indexed {ModelRegistry().rebuild(models_dir)} models from {models_dir}.")
@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+
+import numpy as np
+
+import stacked_inference
+
+# Pure-NumPy forward pass for the fixed Conv1D classifiers. A model is exported once to a flat .npz holding the
+# layer descriptions and weights; loading and running it needs no TensorFlow import.
+
+EXPORT_EXTENSION = ".npz"
+
+
+def export_model(model, filepath):
+    layers = stacked_inference.describe_model(model)
+    arrays = {}
+    for index, layer in enumerate(model.layers):
+        for position, weight in enumerate(layer.get_weights()):
+            arrays[f"layer{index}_weight{position}"] = np.asarray(weight, dtype='float32')
+    tmp_path = filepath + ".tmp.npz"
+    np.savez(tmp_path, __layers__=np.array(json.dumps(layers)), **arrays)
+    os.replace(tmp_path, filepath)
+
+
+class NumpyModel:
+    def __init__(self, layers, weights):
+        self.layers = layers
+        # Add the leading model axis expected by the stacked forward pass.
+        self.weights = [[weight[np.newaxis] for weight in layer_weights] for layer_weights in weights]
+
+    @classmethod
+    def load(cls, filepath):
+        with np.load(filepath) as data:
+            layers = json.loads(str(data['__layers__']))
+            weights = []
+            for index in range(len(layers)):
+                layer_weights = []
+                while f"layer{index}_weight{len(layer_weights)}" in data:
+                    layer_weights.append(data[f"layer{index}_weight{len(layer_weights)}"])
+                weights.append(layer_weights)
+        return cls(layers, weights)
+
+    def predict(self, x, verbose=0):
+        return stacked_inference.forward(self.layers, self.weights, x)[0]
+
+    def get_weights(self):
+        return [weight[0] for layer_weights in self.weights for weight in layer_weights]
+
+    # Hashable description of the architecture, like stacked_inference.architecture_signature for Keras models.
+    def signature(self):
+        return tuple((tuple(sorted(spec.items())), tuple(weight.shape[1:] for weight in layer_weights))
+                     for spec, layer_weights in zip(self.layers, self.weights))
+
+
+# Probabilities of every model for every input, shaped (models, samples, classes), computed in a single forward pass
+# over the weights of models sharing an architecture (e.g. the students of a class).
+def predict_stacked(models, x):
+    weights = [[np.concatenate([model.weights[index][position] for model in models])
+                for position in range(len(layer_weights))]
+               for index, layer_weights in enumerate(models[0].weights)]
+    return stacked_inference.forward(models[0].layers, weights, x)
+
+
+# Maximum absolute difference between the NumPy and the Keras outputs for the given inputs.
+def compare_with_keras(model, numpy_model, x):
+    expected = model.predict(np.expand_dims(x, axis=2), verbose=0)
+    return float(np.max(np.abs(expected - numpy_model.predict(x))))
+
+
+def export_path(keras_path):
+    return os.path.splitext(keras_path)[0] + EXPORT_EXTENSION
+
+
+# Exports a saved .keras model next to itself and checks the export numerically against Keras.
+def export_and_verify(keras_path, x=None, tolerance=1e-4):
+    import keras
+    model = keras.models.load_model(keras_path)
+    filepath = export_path(keras_path)
+    export_model(model, filepath)
+    if x is None:
+        x = np.random.default_rng(0).integers(0, 5, size=(64, 16))
+    difference = compare_with_keras(model, NumpyModel.load(filepath), x)
+    if difference > tolerance:
+        os.remove(filepath)
+        raise ValueError(f"NumPy export of {keras_path} differs from Keras by {difference}")
+    print(f"(NP) Exported {filepath} (max difference {difference:.2e})")
+    return filepath
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        export_and_verify(path)
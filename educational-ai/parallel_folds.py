@@ -0,0 +1,75 @@
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Parallel k-fold training. Every fold trains its own copy of the model in a separate process (each with a bounded
+# TensorFlow thread count) and the fold models are then combined into the final one, either by keeping the fold with
+# the best validation accuracy or by averaging their weights.
+
+FOLD_WORKERS = int(os.environ.get('FOLD_WORKERS', os.cpu_count() or 1))
+COMBINE_MODES = ('best', 'average')
+# CPUs the folds of this process may use: the whole machine, or the share of a training_plan branch process.
+CPU_BUDGET = os.cpu_count() or 1
+
+
+# Bounds the TensorFlow thread pools of a worker process, so parallel workers do not oversubscribe the CPUs.
+def limit_threads(threads):
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(threads)
+
+
+# Trains one fold through all its stages, each stage being (train_indices, val_indices, epochs) into the shared
+# input_pipeline.TrainingData.
+def _train_fold(model_path, data, stages):
+    import tensorflow as tf
+    import service_metrics
+    with service_metrics.model_operation('load_model'):
+        model = tf.keras.models.load_model(model_path)
+    histories = []
+    for train_indices, val_indices, epochs in stages:
+        with service_metrics.model_operation('fit'):
+            history = model.fit(data.dataset(train_indices),
+                                validation_data=data.dataset(val_indices, shuffle=False, cache=True),
+                                epochs=epochs, verbose=2,
+                                callbacks=[tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=2)])
+        histories.append({key: [float(value) for value in values] for key, values in history.history.items()})
+    return histories, model.get_weights()
+
+
+def combine_weights(fold_weights, fold_histories, combine):
+    if combine == 'average':
+        return [np.mean(np.stack(weights), axis=0) for weights in zip(*fold_weights)]
+    scores = [histories[-1]['val_accuracy'][-1] for histories in fold_histories]
+    return fold_weights[int(np.argmax(scores))]
+
+
+# Bounds the fold workers of this process to the given CPUs, along with its own TensorFlow thread pools.
+def limit_cpus(cpus):
+    global CPU_BUDGET
+    CPU_BUDGET = cpus
+    limit_threads(cpus)
+
+
+# Trains every fold in parallel starting from the current state of the model, then loads the combined weights into
+# it. Returns, for every fold, the list of per-stage history dicts. There are never more fold workers than CPUs in
+# CPU_BUDGET.
+def train_folds(model, data, fold_stages, combine='best', workers=None):
+    if combine not in COMBINE_MODES:
+        raise ValueError(f"combine must be one of {COMBINE_MODES}")
+    workers = max(1, min(FOLD_WORKERS if workers is None else workers, CPU_BUDGET, len(fold_stages)))
+    threads = max(1, CPU_BUDGET // workers)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_path = os.path.join(tmp_dir, "fold_start.keras")
+        model.save(model_path)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=limit_threads, initargs=(threads,)) as executor:
+            results = list(executor.map(_train_fold, [model_path] * len(fold_stages), [data] * len(fold_stages),
+                                        fold_stages))
+    fold_histories = [histories for histories, _ in results]
+    model.set_weights(combine_weights([weights for _, weights in results], fold_histories, combine))
+    return fold_histories
@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Memoized predictions. Words are keyed by their encoded row (the tokenizer already lowercases them and drops unknown
+# characters, so every spelling that reaches the model as the same input shares one entry) together with the weight
+# version of the model, so a re-saved model never serves the predictions of its previous weights. The default models
+# also get a vocabulary table: their predictions over every word of the dataset, computed in one pass whenever the model
+# is saved and stored next to the model file, so dictionary words are answered without running the model at all.
+
+MAX_ENTRIES = int(os.environ.get('PREDICTION_CACHE_SIZE', 50000))
+TABLE_EXTENSION = ".predictions.npz"
+
+
+def word_key(encoded_row):
+    return np.asarray(encoded_row, dtype='int32').tobytes()
+
+
+class VocabularyTable:
+    def __init__(self, encoded, probabilities, version):
+        self.encoded = encoded
+        self.probabilities = probabilities
+        self.version = version
+        self._index = {word_key(row): index for index, row in enumerate(encoded)}
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, key):
+        index = self._index.get(key)
+        return None if index is None else self.probabilities[index]
+
+    @classmethod
+    def build(cls, model, encoded, version):
+        encoded = np.unique(np.asarray(encoded, dtype='int32'), axis=0)
+        probabilities = model.predict(np.expand_dims(encoded, axis=2), verbose=0)
+        return cls(encoded, np.asarray(probabilities, dtype='float32'), version)
+
+    # Returns the table stored at filepath, or None when it is missing or was built for another version.
+    @classmethod
+    def load(cls, filepath, version):
+        try:
+            with np.load(filepath) as data:
+                if json.loads(str(data['version'])) != _jsonable(version):
+                    return None
+                return cls(data['encoded'], data['probabilities'], version)
+        except (FileNotFoundError, KeyError, ValueError):
+            return None
+
+    def save(self, filepath):
+        tmp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(tmp_path, encoded=self.encoded, probabilities=self.probabilities,
+                 version=json.dumps(_jsonable(self.version)))
+        os.replace(tmp_path, filepath)
+
+
+def _jsonable(version):
+    return json.loads(json.dumps(version))
+
+
+def table_path(keras_path):
+    return os.path.splitext(keras_path)[0] + TABLE_EXTENSION
+
+
+class PredictionCache:
+    # Bounded LRU cache of prediction rows keyed by (model name, weight version, word key), in front of the vocabulary
+    # tables of the models that have one.
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.table_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    # Returns the cached prediction of every key, None for the ones that have to be computed.
+    def lookup(self, name, version, keys):
+        rows = []
+        with self._lock:
+            table = self._tables.get(name)
+            if table is not None and table.version != version:
+                table = None
+            for key in keys:
+                row = table.get(key) if table is not None else None
+                if row is not None:
+                    self.table_hits += 1
+                else:
+                    row = self._entries.get((name, version, key))
+                    if row is not None:
+                        self._entries.move_to_end((name, version, key))
+                        self.hits += 1
+                    else:
+                        self.misses += 1
+                rows.append(row)
+        return rows
+
+    def store(self, name, version, keys, rows):
+        with self._lock:
+            for key, row in zip(keys, rows):
+                self._entries[(name, version, key)] = np.array(row)
+                self._entries.move_to_end((name, version, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def table(self, name, version):
+        with self._lock:
+            table = self._tables.get(name)
+        return table if table is not None and table.version == version else None
+
+    def set_table(self, name, table):
+        with self._lock:
+            self._tables[name] = table
+
+    def invalidate(self, name):
+        self.invalidate_where(lambda entry_name: entry_name == name)
+
+    def invalidate_where(self, predicate):
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key[0])]:
+                del self._entries[key]
+            for name in [name for name in self._tables if predicate(name)]:
+                del self._tables[name]
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'tables': {name: len(table) for name, table in self._tables.items()},
+                    'hits': self.hits, 'table_hits': self.table_hits, 'misses': self.misses}
@@ -0,0 +1,62 @@
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, \
+    generate_latest, multiprocess
+
+# Prometheus metrics of the service. With PROMETHEUS_MULTIPROC_DIR set (gunicorn.conf.py sets it), every process, the
+# gunicorn workers and their training job processes alike, writes its samples to memory-mapped files in that directory
+# and /metrics aggregates all of them; without it the metrics are those of the current process. Recording a sample is
+# a lock and a few memory writes, so the instrumentation stays on in production.
+
+MULTIPROCESS_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', "Latency of the Flask routes.",
+                            ['method', 'route', 'status'],
+                            buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+MODEL_OPERATION_SECONDS = Histogram('model_operation_duration_seconds',
+                                    "Time spent loading (load_model), running (predict), training (fit) and saving "
+                                    "(save) models.", ['operation'],
+                                    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+                                             300, 900))
+MODEL_BYTES_READ = Counter('model_bytes_read_total', "Bytes of model files read under models/.", ['kind'])
+MODEL_BYTES_WRITTEN = Counter('model_bytes_written_total', "Bytes of model files written under models/.", ['kind'])
+MODEL_CACHE_REQUESTS = Counter('model_cache_requests_total', "Lookups of the in-process model caches.",
+                               ['cache', 'result'])
+TRAINING_JOBS_ACTIVE = Gauge('training_jobs_active', "Training jobs submitted and not finished yet.", ['kind'],
+                             multiprocess_mode='livesum')
+
+
+def model_operation(operation):
+    return MODEL_OPERATION_SECONDS.labels(operation).time()
+
+
+def observe_request(method, route, status, start):
+    REQUEST_SECONDS.labels(method, route, str(status)).observe(time.perf_counter() - start)
+
+
+def bytes_read(kind, size):
+    if size:
+        MODEL_BYTES_READ.labels(kind).inc(size)
+
+
+def bytes_written(kind, filepath):
+    try:
+        MODEL_BYTES_WRITTEN.labels(kind).inc(os.path.getsize(filepath))
+    except OSError:
+        pass
+
+
+def render():
+    if MULTIPROCESS_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+# Removes the live gauge samples of a process that has exited (called by gunicorn when a worker exits).
+def mark_process_dead(pid):
+    if MULTIPROCESS_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,191 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Inference over many models that share one architecture (e.g. every student model cloned from the same base).
+# The weights of N models are stacked along a leading "model" axis so that a single vectorized forward pass
+# evaluates the whole group. Only the layers used by the fixed classifiers in usecase.py are supported.
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'tanh': np.tanh,
+    'softmax': lambda x: _softmax(x)
+}
+
+
+def _softmax(x):
+    exponent = np.exp(x - x.max(axis=-1, keepdims=True))
+    return exponent / exponent.sum(axis=-1, keepdims=True)
+
+
+def _first(value):
+    if isinstance(value, (list, tuple)):
+        return value[0]
+    return value
+
+
+def _activation_name(config):
+    activation = config.get('activation', 'linear')
+    if isinstance(activation, dict):
+        activation = activation.get('config', {}).get('name', activation.get('class_name'))
+    if activation not in ACTIVATIONS:
+        raise ValueError(f"Unsupported activation: {activation}")
+    return activation
+
+
+# Describes a Keras layer with the few hyperparameters the forward pass needs.
+def describe_layer(layer):
+    kind = layer.__class__.__name__
+    config = layer.get_config()
+    if kind == 'BatchNormalization':
+        return {'kind': kind, 'epsilon': float(config['epsilon']),
+                'center': bool(config.get('center', True)), 'scale': bool(config.get('scale', True))}
+    if kind == 'Conv1D':
+        if _first(config.get('dilation_rate', 1)) != 1:
+            raise ValueError("Dilated Conv1D layers are not supported")
+        return {'kind': kind, 'strides': int(_first(config['strides'])), 'padding': config['padding'],
+                'activation': _activation_name(config), 'use_bias': bool(config['use_bias'])}
+    if kind == 'MaxPooling1D':
+        pool_size = int(_first(config['pool_size']))
+        strides = config.get('strides') or pool_size
+        return {'kind': kind, 'pool_size': pool_size, 'strides': int(_first(strides)), 'padding': config['padding']}
+    if kind == 'Dense':
+        return {'kind': kind, 'activation': _activation_name(config), 'use_bias': bool(config['use_bias'])}
+    if kind in ('Dropout', 'Flatten'):
+        return {'kind': kind}
+    raise ValueError(f"Unsupported layer for stacked inference: {kind}")
+
+
+def describe_model(model):
+    return [describe_layer(layer) for layer in model.layers]
+
+
+# Hashable description of the architecture, used to check that models can be stacked together.
+def architecture_signature(model):
+    return tuple((tuple(sorted(spec.items())), tuple(weight.shape for weight in layer.get_weights()))
+                 for spec, layer in zip(describe_model(model), model.layers))
+
+
+def group_by_architecture(named_models):
+    groups = {}
+    for name, model in named_models:
+        groups.setdefault(architecture_signature(model), []).append((name, model))
+    return list(groups.values())
+
+
+class StackedModels:
+    def __init__(self, models):
+        if not models:
+            raise ValueError("At least one model is required")
+        signature = architecture_signature(models[0])
+        for model in models[1:]:
+            if architecture_signature(model) != signature:
+                raise ValueError("Stacked models must share the same architecture")
+        self.layers = describe_model(models[0])
+        self.weights = []
+        for index in range(len(self.layers)):
+            per_model = [model.layers[index].get_weights() for model in models]
+            self.weights.append([np.stack([weights[i] for weights in per_model]).astype('float32')
+                                 for i in range(len(per_model[0]))])
+        self.size = len(models)
+
+    # Returns the probabilities of every model for every input, shaped (models, samples, classes).
+    def predict(self, x, models_per_pass=None):
+        if models_per_pass is None or models_per_pass >= self.size:
+            return forward(self.layers, self.weights, x)
+        outputs = []
+        for start in range(0, self.size, models_per_pass):
+            chunk = [[weight[start:start + models_per_pass] for weight in weights] for weights in self.weights]
+            outputs.append(forward(self.layers, chunk, x))
+        return np.concatenate(outputs)
+
+
+def forward(layers, weights, x):
+    x = np.asarray(x, dtype='float32')
+    if x.ndim == 2:
+        x = np.expand_dims(x, axis=2)
+    output = np.broadcast_to(x, (_stack_size(weights),) + x.shape)
+    for spec, layer_weights in zip(layers, weights):
+        output = LAYERS[spec['kind']](spec, layer_weights, output)
+    return output
+
+
+def _stack_size(weights):
+    for layer_weights in weights:
+        if layer_weights:
+            return layer_weights[0].shape[0]
+    raise ValueError("Cannot stack models without weights")
+
+
+def _expand_channels(values, ndim):
+    # (models, channels) -> (models, 1, ..., 1, channels)
+    return values.reshape((values.shape[0],) + (1,) * (ndim - 2) + (values.shape[-1],))
+
+
+def _batch_normalization(spec, weights, x):
+    weights = list(weights)
+    gamma = weights.pop(0) if spec['scale'] else None
+    beta = weights.pop(0) if spec['center'] else None
+    moving_mean, moving_variance = weights
+    scale = 1 / np.sqrt(moving_variance + spec['epsilon'])
+    if gamma is not None:
+        scale = scale * gamma
+    shift = -moving_mean * scale
+    if beta is not None:
+        shift = shift + beta
+    return x * _expand_channels(scale, x.ndim) + _expand_channels(shift, x.ndim)
+
+
+def _pad_same(x, length, window, strides, value):
+    output_length = -(-length // strides)
+    total = max((output_length - 1) * strides + window - length, 0)
+    pad = [(0, 0)] * x.ndim
+    pad[2] = (total // 2, total - total // 2)
+    return np.pad(x, pad, constant_values=value)
+
+
+def _conv1d(spec, weights, x):
+    kernel = weights[0]
+    size = kernel.shape[1]
+    if spec['padding'] == 'same':
+        x = _pad_same(x, x.shape[2], size, spec['strides'], 0)
+    elif spec['padding'] != 'valid':
+        raise ValueError(f"Unsupported Conv1D padding: {spec['padding']}")
+    windows = sliding_window_view(x, size, axis=2)[:, :, ::spec['strides']]
+    output = np.einsum('mblck,mkco->mblo', windows, kernel, optimize=True)
+    if spec['use_bias']:
+        output = output + weights[1][:, None, None, :]
+    return ACTIVATIONS[spec['activation']](output)
+
+
+def _max_pooling1d(spec, weights, x):
+    if spec['padding'] == 'same':
+        x = _pad_same(x, x.shape[2], spec['pool_size'], spec['strides'], -np.inf)
+    windows = sliding_window_view(x, spec['pool_size'], axis=2)[:, :, ::spec['strides']]
+    return windows.max(axis=-1)
+
+
+def _dense(spec, weights, x):
+    output = np.einsum('mbi,mio->mbo', x, weights[0], optimize=True)
+    if spec['use_bias']:
+        output = output + weights[1][:, None, :]
+    return ACTIVATIONS[spec['activation']](output)
+
+
+def _flatten(spec, weights, x):
+    return x.reshape(x.shape[0], x.shape[1], -1)
+
+
+def _identity(spec, weights, x):
+    return x
+
+
+LAYERS = {
+    'BatchNormalization': _batch_normalization,
+    'Conv1D': _conv1d,
+    'MaxPooling1D': _max_pooling1d,
+    'Dense': _dense,
+    'Dropout': _identity,
+    'Flatten': _flatten
+}
@@ -0,0 +1,110 @@
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+import history_store
+
+# Bounded record of machine-teaching progress. Every /train call adds one plain record per trained epoch (metric
+# values only, no Keras objects) to a SQLite table shared by every worker process, by default in the database of the
+# training histories, so the progress endpoints see the rounds handled by any worker. Once the table holds more than
+# max_records epochs the oldest ones are deleted, so it keeps a fixed size. Progress is aggregated per model and per
+# class on query.
+
+DEFAULT_PATH = os.environ.get('TEACHING_PROGRESS_DB', history_store.DEFAULT_PATH)
+MAX_RECORDS = int(os.environ.get('TEACHING_PROGRESS_SIZE', 10000))
+
+
+class TeachingProgress:
+    def __init__(self, path=DEFAULT_PATH, max_records=MAX_RECORDS):
+        self.path = path
+        self.max_records = max_records
+        with closing(self._connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""CREATE TABLE IF NOT EXISTS teaching_progress (
+                                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                      model TEXT NOT NULL,
+                                      class_code TEXT,
+                                      session INTEGER NOT NULL,
+                                      epoch INTEGER NOT NULL,
+                                      words INTEGER NOT NULL,
+                                      timestamp REAL NOT NULL,
+                                      metrics TEXT NOT NULL)""")
+            connection.execute("CREATE INDEX IF NOT EXISTS teaching_progress_model ON teaching_progress (model, id)")
+            connection.execute("CREATE INDEX IF NOT EXISTS teaching_progress_class "
+                               "ON teaching_progress (class_code, id)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    # Adds the epochs of one teaching session given its Keras history dict ({metric: [value per epoch]}).
+    def record(self, model_name, class_code, history, words=0):
+        epochs = max((len(values) for values in history.values()), default=0)
+        timestamp = time.time()
+        with closing(self._connect()) as connection, connection:
+            # Session numbers are shared by every worker, so the number is taken under the write lock.
+            connection.execute("BEGIN IMMEDIATE")
+            session = connection.execute("SELECT COALESCE(MAX(session), 0) + 1 FROM teaching_progress").fetchone()[0]
+            connection.executemany("""INSERT INTO teaching_progress (model, class_code, session, epoch, words,
+                                                                     timestamp, metrics)
+                                      VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                                   [(model_name, class_code, session, epoch + 1, words, timestamp,
+                                     json.dumps({key: float(values[epoch]) for key, values in history.items()
+                                                 if epoch < len(values)}))
+                                    for epoch in range(epochs)])
+            connection.execute("DELETE FROM teaching_progress WHERE id <= (SELECT MAX(id) FROM teaching_progress) - ?",
+                               (self.max_records,))
+
+    def for_model(self, model_name):
+        records = self._select("model = ?", model_name)
+        if not records:
+            return None
+        return summarize(model_name, records)
+
+    def for_class(self, class_code):
+        records = self._select("class_code = ?", class_code)
+        if not records:
+            return None
+        by_model = {}
+        for record in records:
+            by_model.setdefault(record['model'], []).append(record)
+        return {
+            'class_code': class_code,
+            'sessions': len({record['session'] for record in records}),
+            'epochs': len(records),
+            'models': [summarize(model_name, model_records) for model_name, model_records in by_model.items()]
+        }
+
+    # Records matching the condition, in the order they were added.
+    def _select(self, condition, value):
+        with closing(self._connect()) as connection:
+            rows = connection.execute(f"""SELECT model, class_code, session, epoch, words, timestamp, metrics
+                                          FROM teaching_progress WHERE {condition} ORDER BY id""", (value,)).fetchall()
+        return [{'model': model, 'class_code': class_code, 'session': session, 'epoch': epoch, 'words': words,
+                 'timestamp': timestamp, 'metrics': json.loads(metrics)}
+                for model, class_code, session, epoch, words, timestamp, metrics in rows]
+
+    def __len__(self):
+        with closing(self._connect()) as connection:
+            return connection.execute("SELECT COUNT(*) FROM teaching_progress").fetchone()[0]
+
+
+# Per-model view: totals, the last epoch metrics, and the per-session progression in chronological order.
+def summarize(model_name, records):
+    sessions = {}
+    for record in records:
+        session = sessions.setdefault(record['session'], {'session': record['session'], 'words': record['words'],
+                                                          'timestamp': record['timestamp'], 'epochs': 0,
+                                                          'metrics': {}})
+        session['epochs'] += 1
+        session['metrics'] = record['metrics']
+    return {
+        'model': model_name,
+        'class_code': records[-1]['class_code'],
+        'sessions': len(sessions),
+        'epochs': len(records),
+        'words': sum(session['words'] for session in sessions.values()),
+        'last_metrics': records[-1]['metrics'],
+        'progression': list(sessions.values())
+    }
@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+
+from benchmarks import workspace
+
+# Students created by load_new are lazy until their first save: their first teach or train round materializes them
+# from the base model. The rounds run in a benchmark workspace (synthetic dataset and default models), in a process of
+# their own, as the app is imported with the models and registry of its working directory.
+SCRIPT = """
+import dataset_cache
+import model_registry
+import workspace
+
+dataset, _, _ = dataset_cache.load_or_build()
+workspace.build_models('models', dataset['x_train'], dataset['y_train'])
+model_registry.ModelRegistry().rebuild('models')
+
+import app
+import usecase
+
+# A base model saved by this process (e.g. by a reset) is cached as a weights-only copy.
+base_model_name = 'curriculum_under_trained_k_folds'
+usecase.save_pretrained_model(usecase.get_writable_model(base_model_name), base_model_name)
+usecase.model_writer.flush()
+client = app.app.test_client()
+words = {str(word): label for word, label in zip(dataset['x_increment_01_unencoded'][:10], 'DHGDHGDHGD')}
+for model_name in ('taught_ABC_20241002T153012', 'trained_ABC_20241002T153013'):
+    assert client.post(f'/models/{model_name}').status_code < 400
+    assert usecase.lazy_base(model_name) == base_model_name
+
+response = client.post('/models/taught_ABC_20241002T153012/train', json=words)
+assert response.status_code < 400, response.get_data(as_text=True)
+usecase.train('trained_ABC_20241002T153013', dataset['x_train'], dataset['y_train'], epochs=1)
+usecase.model_writer.flush()
+for model_name in ('taught_ABC_20241002T153012', 'trained_ABC_20241002T153013'):
+    assert usecase.lazy_base(model_name) is None
+    assert usecase.get_writable_model(model_name).compiled
+print('lazy students materialized')
+
+usecase.tflite_exporter.shutdown(wait=True)
+app.training_jobs.shutdown(wait=True)
+"""
+
+
+def test_lazy_students_are_taught_and_trained(tmp_path):
+    workspace_dir = workspace.create(str(tmp_path / 'workspace'))
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join([workspace_dir, os.path.dirname(workspace.__file__)]),
+                       TF_CPP_MIN_LOG_LEVEL='2', MODEL_SAVE_DELAY='0',
+                       MODEL_REGISTRY_DB=os.path.join(workspace_dir, 'models', '.registry.sqlite3'),
+                       HISTORY_DB=os.path.join(workspace_dir, 'histories.sqlite3'),
+                       TUNING_DIR=os.path.join(workspace_dir, 'tuning'))
+    environment.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    result = subprocess.run([sys.executable, '-c', SCRIPT], cwd=workspace_dir, env=environment, capture_output=True,
+                            text=True, timeout=600)
+    assert result.returncode == 0, result.stdout[-2000:] + result.stderr[-4000:]
+    assert 'lazy students materialized' in result.stdout
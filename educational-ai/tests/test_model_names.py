@@ -0,0 +1,41 @@
+import sqlite3
+
+import model_registry
+
+# Students created by the frontend (server.js) are named <student>_<class_code>_<YYYYMMDDTHHMMSS>.
+FRONTEND_NAME = "juan_ABC_20241002T153012"
+
+
+def test_parse_frontend_student_name():
+    assert model_registry.parse_model_name(FRONTEND_NAME) == ("juan", "ABC", "20241002T153012")
+    assert model_registry.parse_model_name(FRONTEND_NAME + ".keras") == ("juan", "ABC", "20241002T153012")
+    assert model_registry.parse_model_name(FRONTEND_NAME + ".delta.npz") == ("juan", "ABC", "20241002T153012")
+
+
+def test_parse_numeric_student_name():
+    assert model_registry.parse_model_name("ana_PC1_1700000000") == ("ana", "PC1", "1700000000")
+
+
+def test_parse_default_model_names():
+    for name in ("max", "under_trained", "max_k_folds", "curriculum_under_trained",
+                 "curriculum_under_trained_k_folds"):
+        assert model_registry.parse_model_name(name) == (None, None, None)
+
+
+def test_registry_indexes_frontend_students_in_their_class(tmp_path):
+    registry = model_registry.ModelRegistry(str(tmp_path / "registry.sqlite3"))
+    registry.register_lazy(FRONTEND_NAME, "curriculum_under_trained_k_folds",
+                           str(tmp_path / "curriculum_under_trained_k_folds.keras"))
+    row = registry.get(FRONTEND_NAME)
+    assert (row['student'], row['class_code'], row['timestamp']) == ("juan", "ABC", "20241002T153012")
+    assert registry.names("ABC") == [FRONTEND_NAME]
+    models, total = registry.list(defaults=True)
+    assert total == 0
+
+
+def test_registry_reindexes_students_taken_for_default_models(tmp_path):
+    path = str(tmp_path / "registry.sqlite3")
+    model_registry.ModelRegistry(path)
+    with sqlite3.connect(path) as connection:
+        connection.execute("INSERT INTO models (name, path) VALUES (?, ?)", (FRONTEND_NAME, "x.keras"))
+    assert model_registry.ModelRegistry(path).names("ABC") == [FRONTEND_NAME]
@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import threading
+
+import numpy as np
+
+# Quantized TFLite exports of the models, served with the TFLite interpreter. A model is converted to a float16 or
+# int8 flatbuffer (int8 calibrated on samples of x_train) and kept only when its accuracy on x_test stays within
+# MAX_ACCURACY_DROP of the Keras model. A sidecar <export>.json keeps what the flatbuffer cannot: the quantization,
+# the regularization loss of the model (so evaluations report the same loss as model.evaluate) and the check result.
+
+EXPORT_EXTENSION = ".tflite"
+QUANTIZATIONS = ('float32', 'float16', 'int8')
+QUANTIZATION = os.environ.get('TFLITE_QUANTIZATION', 'float16')
+MAX_ACCURACY_DROP = float(os.environ.get('TFLITE_MAX_ACCURACY_DROP', 0.01))
+CALIBRATION_SAMPLES = 200
+
+
+def convert(model, quantization=QUANTIZATION, representative=None):
+    import tensorflow as tf
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"quantization must be one of {QUANTIZATIONS}")
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization != 'float32':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        if representative is None:
+            raise ValueError("int8 quantization needs representative samples")
+        samples = np.asarray(representative, dtype='float32')[:CALIBRATION_SAMPLES].reshape(-1, 1, 16, 1)
+        converter.representative_dataset = lambda: ([sample] for sample in samples)
+    return converter.convert()
+
+
+def export_model(model, filepath, quantization=QUANTIZATION, representative=None):
+    write_export(model, filepath, convert(model, quantization, representative), quantization)
+
+
+def write_export(model, filepath, flatbuffer, quantization, check=None):
+    metadata = {
+        'quantization': quantization,
+        'regularization_loss': sum(float(loss) for loss in getattr(model, 'losses', [])),
+        'metrics_names': list(getattr(model, 'metrics_names', [])),
+        'check': check
+    }
+    # The sidecar goes first, so a new flatbuffer is never paired with stale metadata.
+    _write_atomic(metadata_path(filepath), json.dumps(metadata).encode())
+    _write_atomic(filepath, flatbuffer)
+
+
+def _write_atomic(filepath, content):
+    tmp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as tmp_file:
+        tmp_file.write(content)
+    os.replace(tmp_path, filepath)
+
+
+def _interpreter(model_content):
+    # The standalone LiteRT runtime is used when installed; tf.lite otherwise.
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        from tensorflow.lite.python.interpreter import Interpreter
+    return Interpreter(model_content=model_content)
+
+
+class TFLiteModel:
+    def __init__(self, flatbuffer, metadata):
+        self.metadata = metadata
+        self.losses = [metadata.get('regularization_loss', 0.0)]
+        self.metrics_names = metadata.get('metrics_names') or ['loss', 'accuracy']
+        # The interpreter reads the model from this buffer, so it is kept for as long as the interpreter.
+        self._flatbuffer = flatbuffer
+        self._interpreter = _interpreter(flatbuffer)
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = None
+        # An interpreter runs one inference at a time.
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, filepath):
+        with open(filepath, 'rb') as flatbuffer_file:
+            flatbuffer = flatbuffer_file.read()
+        try:
+            with open(metadata_path(filepath)) as metadata_file:
+                metadata = json.load(metadata_file)
+        except FileNotFoundError:
+            metadata = {}
+        return cls(flatbuffer, metadata)
+
+    def predict(self, x, verbose=0):
+        x = np.asarray(x, dtype='float32')
+        if x.ndim == 2:
+            x = x[..., np.newaxis]
+        with self._lock:
+            if self._batch_size != len(x):
+                self._interpreter.resize_tensor_input(self._input['index'], list(x.shape))
+                self._interpreter.allocate_tensors()
+                self._batch_size = len(x)
+            self._interpreter.set_tensor(self._input['index'], x)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output['index']).copy()
+
+    # The flatbuffer holds the (quantized) weights, so it is what the model caches account for.
+    def get_weights(self):
+        return [np.frombuffer(self._flatbuffer, dtype='uint8')]
+
+
+def export_path(keras_path):
+    return os.path.splitext(keras_path)[0] + EXPORT_EXTENSION
+
+
+def metadata_path(filepath):
+    return filepath + ".json"
+
+
+# Accuracy of the Keras model and of its export on the test set, and how often both predict the same class.
+def compare_with_keras(model, tflite_model, x_test, y_test):
+    x = np.expand_dims(np.asarray(x_test, dtype='float32'), axis=2)
+    expected = np.argmax(model.predict(x, verbose=0), axis=1)
+    predicted = np.argmax(tflite_model.predict(x), axis=1)
+    true_classes = np.argmax(y_test, axis=1)
+    return {
+        'keras_accuracy': float(np.mean(expected == true_classes)),
+        'tflite_accuracy': float(np.mean(predicted == true_classes)),
+        'agreement': float(np.mean(expected == predicted))
+    }
+
+
+# Exports the model next to its .keras file and keeps the export only if its accuracy on x_test does not drop more
+# than max_drop below the Keras model.
+def export_and_verify(model, keras_path, x_train, x_test, y_test, quantization=QUANTIZATION,
+                      max_drop=MAX_ACCURACY_DROP):
+    filepath = export_path(keras_path)
+    flatbuffer = convert(model, quantization, np.expand_dims(x_train, axis=2))
+    check = compare_with_keras(model, TFLiteModel(flatbuffer, {}), x_test, y_test)
+    check['quantization'] = quantization
+    if check['keras_accuracy'] - check['tflite_accuracy'] > max_drop:
+        raise ValueError(f"{quantization} TFLite export of {keras_path} loses accuracy: {check}")
+    write_export(model, filepath, flatbuffer, quantization, check)
+    print(f"(TL) Exported {filepath} ({os.path.getsize(filepath)} bytes, {check})")
+    return filepath, check
+
+
+if __name__ == '__main__':
+    import keras
+    import dataset_cache
+    parser = argparse.ArgumentParser(description="Export .keras models to quantized TFLite flatbuffers.")
+    parser.add_argument('models', nargs='+')
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default=QUANTIZATION)
+    parser.add_argument('--max-drop', type=float, default=MAX_ACCURACY_DROP)
+    arguments = parser.parse_args()
+    dataset, _, _ = dataset_cache.load_or_build()
+    for path in arguments.models:
+        export_and_verify(keras.models.load_model(path), path, dataset['x_train'], dataset['x_test'],
+                          dataset['y_test'], arguments.quantization, arguments.max_drop)
@@ -1,5 +1,7 @@
 import string
 
+import numpy as np
+
 
 def customize_word_index(dictionary):
     for key in dictionary.keys():
@@ -7,6 +9,52 @@ def customize_word_index(dictionary):
     return dictionary
 
 
+# Encodes a batch of words into the padded int matrix that Tokenizer.texts_to_sequences + pad_sequences produce for
+# a char-level tokenizer, using a code-point lookup table over a NumPy char buffer instead of per-char Python loops.
+class CharCodeEncoder:
+    def __init__(self, word_index, oov_index=None):
+        chars = [char for char in word_index if len(char) == 1]
+        # Characters missing from the index are dropped (-1), exactly as texts_to_sequences does.
+        self.unknown = -1 if oov_index is None else oov_index
+        self.lookup = np.full(max((ord(char) for char in chars), default=0) + 1, self.unknown, dtype=np.int64)
+        for char in chars:
+            self.lookup[ord(char)] = word_index[char]
+
+    def encode(self, words, maxlen):
+        output = np.zeros((len(words), maxlen), dtype=np.int32)
+        if len(words) == 0:
+            return output
+        lowered = np.char.lower(np.asarray(words, dtype=str))
+        code_points = lowered.view(np.uint32).reshape(len(words), -1)
+        known = code_points < len(self.lookup)
+        values = np.where(known, self.lookup[np.where(known, code_points, 0)], self.unknown)
+        # Code point 0 is the padding of the fixed-width char buffer.
+        kept = (values >= 0) & (code_points != 0)
+        # Keep the last maxlen codes of every word, right-aligned ('pre' padding and truncating).
+        columns = maxlen - kept.sum(axis=1, keepdims=True) + np.cumsum(kept, axis=1) - 1
+        kept &= columns >= 0
+        rows = np.nonzero(kept)[0]
+        output[rows, columns[kept]] = values[kept]
+        return output
+
+
+_encoders = {}
+
+
+# Returns the (cached) encoder for the current word index of a char-level Tokenizer.
+def get_encoder(tokenizer):
+    key = (frozenset(tokenizer.word_index.items()), tokenizer.oov_token)
+    encoder = _encoders.get(key)
+    if encoder is None:
+        oov_index = tokenizer.word_index.get(tokenizer.oov_token) if tokenizer.oov_token else None
+        encoder = _encoders[key] = CharCodeEncoder(tokenizer.word_index, oov_index)
+    return encoder
+
+
+def encode_words(tokenizer, words, maxlen):
+    return get_encoder(tokenizer).encode(words, maxlen)
+
+
 def __get_index_for_token(char):
     # Eliminar puntuación
     char = char.lower().translate(str.maketrans('', '', string.punctuation))
@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from model_cache import file_signature
+
+# Warm training sessions for students taught in consecutive rounds. A session keeps the compiled model of a student
+# in memory, so the next round reuses its optimizer state and the already traced train function instead of loading
+# and compiling the model again. Sessions idle for longer than SESSION_TTL seconds are closed, and a session is
+# discarded whenever the model file was changed by someone else (e.g. another worker).
+
+SESSION_TTL = float(os.environ.get('TEACH_SESSION_TTL', 15 * 60))
+MAX_SESSIONS = int(os.environ.get('TEACH_SESSIONS', 32))
+
+
+class TrainerSessions:
+    def __init__(self, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    # Returns the warm model of a session, or loads it with loader(filepath), prepares it for training with
+    # prepare(model) and opens a new session.
+    def get(self, name, filepath, loader, prepare):
+        self.expire()
+        signature = file_signature(filepath)
+        with self._lock:
+            session = self._sessions.get(name)
+            if session is not None and session['signature'] == signature:
+                session['last_used'] = time.monotonic()
+                self._sessions.move_to_end(name)
+                return session['model']
+        model = loader(filepath)
+        prepare(model)
+        if self.ttl > 0:
+            self._open(name, model, signature)
+        return model
+
+    # Records the file written by the session itself, so the session stays valid after its own saves.
+    def saved(self, name, filepath):
+        with self._lock:
+            session = self._sessions.get(name)
+            if session is not None:
+                session['signature'] = file_signature(filepath)
+                session['last_used'] = time.monotonic()
+
+    def end(self, name):
+        with self._lock:
+            self._sessions.pop(name, None)
+
+    def end_where(self, predicate):
+        with self._lock:
+            for name in [name for name in self._sessions if predicate(name)]:
+                del self._sessions[name]
+
+    def expire(self):
+        limit = time.monotonic() - self.ttl
+        with self._lock:
+            for name in [name for name, session in self._sessions.items() if session['last_used'] < limit]:
+                print(f"(TS) Closing idle training session of {name}.")
+                del self._sessions[name]
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _open(self, name, model, signature):
+        with self._lock:
+            self._sessions[name] = {'model': model, 'signature': signature, 'last_used': time.monotonic()}
+            self._sessions.move_to_end(name)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap, daemon=True)
+                self._reaper.start()
+
+    # Closes idle sessions even when no further teaching happens in this process.
+    def _reap(self):
+        while True:
+            time.sleep(max(self.ttl / 2, 1))
+            self.expire()
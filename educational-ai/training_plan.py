@@ -0,0 +1,104 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import jobs
+import parallel_folds
+
+# Training plan for the default models. The models form a dependency graph whose only edges are checkpoint
+# snapshots: under_trained is exactly the first epoch of the max schedule (same initial model, data, validation split
+# and optimizer), so when both are missing it is saved from the max run after epoch 1 instead of being trained again.
+# The other under-trained variants are not prefixes of their max counterparts: curriculum_under_trained trains its
+# second stage right after one epoch of the first one (curriculum_max after two), and the k-fold variants move to the
+# next fold after one epoch, so every later fold starts from different weights. They keep their own runs.
+# Every remaining branch is independent, so the branches run in parallel processes, at most (and by default) as many
+# as the CPUs of the training job: the CPUs are shared by the TRAINING_WORKERS jobs that may train at a time (jobs.py).
+# The CPUs of the job are split between the branch processes, and the parallel k-fold workers of a branch only use its
+# share, so the plan never runs more training processes than its job has CPUs. TRAINING_PLAN_WORKERS=1 trains the
+# branches in turn.
+
+PLAN_WORKERS = int(os.environ.get('TRAINING_PLAN_WORKERS', 0))
+# Model saved as a snapshot of another model's run: {snapshot: (source, epoch)}.
+SNAPSHOTS = {
+    "under_trained.keras": ("max.keras", 1)
+}
+
+
+# Returns the training branches for the missing models, each one {'model': name, 'snapshots': {name: epoch}}.
+def build_plan(models_missing):
+    branches = []
+    for model_name in models_missing:
+        source = SNAPSHOTS.get(model_name)
+        if source is not None and source[0] in models_missing:
+            continue
+        snapshots = {snapshot: epoch for snapshot, (source_name, epoch) in SNAPSHOTS.items()
+                     if source_name == model_name and snapshot in models_missing}
+        branches.append({'model': model_name, 'snapshots': snapshots})
+    return branches
+
+
+# Keras callback saving a copy of the model being trained, with its history so far, after the given epochs.
+def snapshot_callback(snapshots):
+    import tensorflow as tf
+    import usecase
+
+    class SnapshotCallback(tf.keras.callbacks.Callback):
+        def __init__(self):
+            super().__init__()
+            self.history = {}
+
+        def on_epoch_end(self, epoch, logs=None):
+            for key, value in (logs or {}).items():
+                self.history.setdefault(key, []).append(float(value))
+            for snapshot, snapshot_epoch in snapshots.items():
+                if snapshot_epoch == epoch + 1:
+                    print(f"(TP) Saving {snapshot} from epoch {epoch + 1} of the current run ...")
+                    usecase.save_pretrained_model(copy_model(self.model), name=snapshot)
+                    usecase.model_histories[snapshot] = self.history
+
+    return SnapshotCallback()
+
+
+# Independent copy of a compiled model, including its optimizer state.
+def copy_model(model):
+    import tensorflow as tf
+    copy = tf.keras.models.clone_model(model)
+    copy.set_weights(model.get_weights())
+    copy.compile(optimizer=type(model.optimizer).from_config(model.optimizer.get_config()),
+                 loss=model.loss, metrics=['accuracy'])
+    copy.optimizer.build(copy.trainable_variables)
+    for target, source in zip(copy.optimizer.variables, model.optimizer.variables):
+        target.assign(source)
+    return copy
+
+
+def _run_branch(branch, initial_path, datasets):
+    import usecase
+    model = usecase.load_keras_model(initial_path)
+    usecase.train_default_model(model, branch['model'], *datasets,
+                                callbacks=[snapshot_callback(branch['snapshots'])] if branch['snapshots'] else None)
+    usecase.model_writer.flush()
+    return branch['model']
+
+
+# Trains the plan branches, each from a fresh copy of its initial model file ({model: path}). datasets are the
+# arguments of usecase.train_default_model after the model name.
+def run(branches, initial_paths, datasets, workers=PLAN_WORKERS, progress=None):
+    job_cpus = max(1, (os.cpu_count() or 1) // jobs.MAX_WORKERS)
+    workers = max(1, min(workers or job_cpus, len(branches), job_cpus))
+    if workers == 1:
+        for index, branch in enumerate(branches):
+            if progress is not None:
+                progress(stage=branch['model'], completed=index, total=len(branches))
+            _run_branch(branch, initial_paths[branch['model']], datasets)
+        return
+    cpus = max(1, job_cpus // workers)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=parallel_folds.limit_cpus, initargs=(cpus,)) as executor:
+        futures = [executor.submit(_run_branch, branch, initial_paths[branch['model']], datasets)
+                   for branch in branches]
+        for index, future in enumerate(as_completed(futures)):
+            model_name = future.result()
+            print(f"(TP) {model_name} trained.")
+            if progress is not None:
+                progress(stage=model_name, completed=index + 1, total=len(branches))
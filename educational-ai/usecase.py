@@ -1,26 +1,80 @@
 import os
-import re
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import keras.models
 from sklearn.model_selection import StratifiedKFold
-from keras import Sequential
-from keras.layers import LSTM, BatchNormalization, Dropout, Dense, Flatten, Conv1D, MaxPooling1D
 
+import dataset_cache
+import delta_storage
+import evaluation_cache
+import history_store
+import hp_search
+import input_pipeline
 import machine_teaching
+import model_cache
+import model_persistence
+import model_registry
+import numpy_inference
+import parallel_folds
+import prediction_cache
+import service_metrics
+import stacked_inference
+import tflite_inference
 import numpy as np
-import tensorflow as tf
 import graph_utils
-
-from keras_tuner import BayesianOptimization
-from keras.utils import pad_sequences
-from keras.regularizers import l1_l2
-
-
-model_histories = {}
+import tokenizer_utils as ts_utils
+import training_plan
+import trainer_sessions
+
+# TensorFlow and Keras are imported by the functions that build, train or load Keras models, so that a worker serving
+# predictions with the numpy backend never loads them.
+
+
+# Training histories, shared by every worker process through history_store.
+model_histories = history_store.HistoryStore()
+# Loaded models shared by every request served by this process.
+loaded_models = model_cache.ModelCache(name="keras")
+# Backend used to serve predictions: "keras" (model.predict), "numpy" (numpy_inference exports) or "tflite"
+# (quantized tflite_inference exports, also used by evaluate).
+inference_backend = os.environ.get('INFERENCE_BACKEND', 'keras')
+numpy_models = model_cache.ModelCache(name="numpy")
+tflite_models = model_cache.ModelCache(name="tflite")
+# Model files whose TFLite export failed the accuracy check, served with Keras until saved again: {name: signature}.
+tflite_rejected = {}
+# TFLite exports run one at a time on a background thread, and the Keras model is served until a fresh export exists:
+# {name: future} of the exports queued or running.
+tflite_exporter = ThreadPoolExecutor(max_workers=1)
+tflite_exports = {}
+tflite_exports_lock = threading.Lock()
+# Test-set evaluations, reused until the model is saved again.
+evaluations = evaluation_cache.EvaluationCache()
+# Predictions memoized per model weight version, plus the vocabulary tables of the default models.
+predictions = prediction_cache.PredictionCache()
+# Storage format of student models: "keras" (full .keras copies) or "delta" (delta_storage against the base).
+model_storage = os.environ.get('MODEL_STORAGE', 'keras')
+# Models loaded concurrently by evaluate, and how many same-architecture models share one batched forward pass.
+evaluate_workers = int(os.environ.get('EVALUATE_WORKERS', 4))
+evaluate_batch_size = int(os.environ.get('EVALUATE_BATCH_SIZE', 8))
+# K-fold training mode: folds trained one after another on the same model, or as independent parallel fold models
+# combined at the end ("best" fold or weight "average").
+kfold_parallel = os.environ.get('KFOLD_PARALLEL', '').lower() in ('1', 'true', 'yes')
+kfold_combine = os.environ.get('KFOLD_COMBINE', 'best')
+# Students being taught keep their compiled model warm between teach() rounds (TEACH_SESSION_TTL=0 disables it).
+teaching_sessions = trainer_sessions.TrainerSessions()
+# Saved models are written atomically, behind the request (before the save returns with MODEL_SAVE_DELAY=0).
+model_writer = model_persistence.ModelWriter()
+# Index of the stored models, shared by every worker.
+registry = model_registry.ModelRegistry()
+teaching_learning_rate = 0.0000325
+# Hypermodel searched for the conventional models: "fixed" (sequential_basic_cnn_fixed, a single trial) or "search"
+# (the sequential_basic_cnn search space, HP_MAX_TRIALS trials).
+search_space = os.environ.get('HP_SEARCH_SPACE', 'fixed')
+search_max_trials = int(os.environ.get('HP_MAX_TRIALS', 10))
 
 
 def sequential_model(x_train, x_test, y_train, y_test):
+    import tensorflow as tf
     model = tf.keras.models.Sequential()
     model.add(tf.keras.layers.Dense(128))
     model.add(tf.keras.layers.Dense(128))
@@ -36,46 +90,29 @@ def sequential_model(x_train, x_test, y_train, y_test):
 
 
 def fine_tuning(x_train, y_train):
-    tuner = BayesianOptimization(
-        hypermodel=sequential_basic_cnn_fixed,
-        objective='val_accuracy',
-        max_trials=1,
-        executions_per_trial=1,
-        project_name='machine_teaching_base_cnn',
-        overwrite=True)
+    if search_space == "search":
+        hypermodel, max_trials = sequential_basic_cnn, search_max_trials
+    else:
+        hypermodel, max_trials = sequential_basic_cnn_fixed, 1
     # Accuracy custom metric by estimated difficulty.
     # custom_accuracy = custom_metrics.AccuracyByDifficultyLevel(initialData, x_train, y_train)
-    stop_early = tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=2)
-    tuner.search(x_train, y_train, validation_split=0.30,
-                 epochs=15,
-                 callbacks=[stop_early])
-    print(tuner.results_summary())
-    optimized_hp = tuner.get_best_hyperparameters()[0]
-    print(f"(HP) Best HP for the current state: {optimized_hp} ...")
-    return tuner.hypermodel.build(optimized_hp)
+    best_model, optimized_hp = hp_search.search(hypermodel, 'machine_teaching_base_cnn', [(x_train, y_train, 15)],
+                                                max_trials=max_trials)
+    print(f"(HP) Best HP for the current state: {optimized_hp.values} ...")
+    return best_model
 
 
 def fine_tuning_curriculum(x_train_list, y_train_list):
-    tuner = BayesianOptimization(
-        hypermodel=sequential_curriculum_cnn_fixed,
-        objective='val_accuracy',
-        max_trials=1,
-        executions_per_trial=1,
-        project_name='machine_teaching_curriculum_cnn',
-        overwrite=True)
-
-    stop_early = tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=2)
     epochs = [3, 5, 12]
-    for x_train, y_train, epoch in zip(x_train_list, y_train_list, epochs):
-        tuner.search(x_train, y_train, validation_split=0.30, epochs=epoch, callbacks=[stop_early])
-
-    print(tuner.results_summary())
-    optimized_hp_curriculum = tuner.get_best_hyperparameters()[0]
-    print(f"(HP) Best HP for curriculum state: {optimized_hp_curriculum} ...")
-    return tuner.hypermodel.build(optimized_hp_curriculum)
+    best_model_curriculum, optimized_hp_curriculum = hp_search.search(sequential_curriculum_cnn_fixed,
+                                                                      'machine_teaching_curriculum_cnn',
+                                                                      list(zip(x_train_list, y_train_list, epochs)))
+    print(f"(HP) Best HP for curriculum state: {optimized_hp_curriculum.values} ...")
+    return best_model_curriculum
 
 
 def sequential_basic_cnn_fixed(hp):
+    import tensorflow as tf
     model = tf.keras.models.Sequential()
     model.add(tf.keras.layers.BatchNormalization())
     model.add(tf.keras.layers.Conv1D(filters=900,
@@ -101,6 +138,9 @@ def sequential_basic_cnn_fixed(hp):
 
 
 def sequential_curriculum_cnn_fixed(hp):
+    from keras import Sequential
+    from keras.layers import BatchNormalization, Dropout, Dense, Flatten, Conv1D, MaxPooling1D
+    from keras.regularizers import l1_l2
     model = Sequential()
     model.add(BatchNormalization())
 
@@ -123,7 +163,10 @@ def sequential_curriculum_cnn_fixed(hp):
 
 
 def sequential_basic_cnn(hp):
+    import keras
+    from keras.regularizers import l1_l2
     model = keras.models.Sequential()
+    model.add(keras.Input(shape=(16, 1)))
     model.add(keras.layers.BatchNormalization())
     filters_base = hp.Int('filters_base', min_value=50, max_value=500, step=50)
     kernel_size_base = hp.Int('kernel_size_base', min_value=2, max_value=6, step=1)
@@ -135,7 +178,7 @@ def sequential_basic_cnn(hp):
     model.add(keras.layers.Conv1D(
         filters=filters_base,
         kernel_size=kernel_size_base,
-        activation="relu", padding='same', input_shape=(16, 1)))
+        activation="relu", padding='same'))
     model.add(keras.layers.MaxPooling1D(
         pool_size=pool_base, padding='same'))
     model.add(keras.layers.Dropout(dropout_rate))
@@ -156,39 +199,219 @@ def sequential_basic_cnn(hp):
 
 def predict(model_name, tokenizer, word, padding=16):
     padding = max(padding, len(word))
-    encoded = tokenizer.texts_to_sequences([word])
-    padded = pad_sequences(encoded, maxlen=padding)
-    model = get_pretrained_model(model_name)
-    output = np.round(model.predict(np.expand_dims(padded, axis=2)))
+    padded = ts_utils.encode_words(tokenizer, [word], padding)
+    output = np.round(predict_encoded(model_name, padded))
     if len(output.shape) == 3 and output.shape[0] == 1:
         output = output.squeeze(axis=0)
     parsed_output = label_result_single(output, labels=["diptongo", "hiato", "ninguna"])
     return parsed_output
 
 
+# Classifies many words with a single batched forward pass.
+def predict_batch(model_name, tokenizer, words, padding=16, labels=None):
+    if labels is None:
+        labels = ["diptongo", "hiato", "ninguna"]
+    padded = encode_words(tokenizer, words, padding)
+    probabilities = predict_encoded(model_name, padded)
+    results = []
+    for word, row in zip(words, probabilities):
+        results.append({
+            "word": word,
+            "label": labels[int(np.argmax(row))],
+            "probabilities": {label: float(value) for label, value in zip(labels, row)}
+        })
+    return results
+
+
+# Probabilities of the encoded words. Dictionary words of default models come from their vocabulary table, words
+# already predicted with the same weights from the prediction cache, and only the rest run through the model.
+def predict_encoded(model_name, encoded):
+    version = prediction_version(model_name)
+    if version is None:
+        model = get_inference_model(model_name)
+        with service_metrics.model_operation('predict'):
+            return model.predict(np.expand_dims(encoded, axis=2), verbose=0)
+    if not is_student_model(model_name):
+        load_vocabulary_table(model_name, version)
+    keys = [prediction_cache.word_key(row) for row in encoded]
+    rows = predictions.lookup(model_name, version, keys)
+    missing = [index for index, row in enumerate(rows) if row is None]
+    if missing:
+        model = get_inference_model(model_name)
+        with service_metrics.model_operation('predict'):
+            computed = model.predict(np.expand_dims(encoded[missing], axis=2), verbose=0)
+        predictions.store(model_name, version, [keys[index] for index in missing], computed)
+        for index, row in zip(missing, computed):
+            rows[index] = row
+    return np.asarray(rows)
+
+
+# Version of the weights a prediction of the model comes from, or None while the model has unsaved weights.
+def prediction_version(model_name):
+    if model_name in model_writer.pending():
+        return None
+    signature = model_cache.file_signature(stored_model_path(model_name))
+    return None if signature is None else (inference_backend, signature)
+
+
+# Loads the vocabulary table of a default model, building it (one pass over every word of the dataset) and storing it
+# next to the model when it is missing or was built from older weights. Saves of default models build it right after
+# their write, so predictions only build it for models written before the tables existed.
+def load_vocabulary_table(model_name, version=None):
+    version = version or prediction_version(model_name)
+    if version is None or predictions.table(model_name, version) is not None:
+        return
+    filepath = prediction_cache.table_path(resolve_model_path(model_name))
+    table = prediction_cache.VocabularyTable.load(filepath, version)
+    if table is None:
+        dataset, _, _ = dataset_cache.load_or_build()
+        table = prediction_cache.VocabularyTable.build(get_inference_model(model_name), dataset['x'], version)
+        table.save(filepath)
+        print(f"(PC) Precomputed {len(table)} predictions of {model_name}.")
+    predictions.set_table(model_name, table)
+
+
+# A table that cannot be built does not fail the save: predictions run the model and try to build it again.
+def build_vocabulary_table(model_name):
+    try:
+        load_vocabulary_table(model_name)
+    except Exception as e:
+        print(f"(PC) Building the vocabulary table of {model_name} failed: {e}")
+
+
+# Classifies the words with every student model of a class, one vectorized pass per architecture.
+def predict_class(class_code, tokenizer, words, padding=16, labels=None):
+    if labels is None:
+        labels = ["diptongo", "hiato", "ninguna"]
+    model_names = list_class_models(class_code)
+    if not model_names:
+        raise FileNotFoundError(f"Class {class_code} has no models")
+    padded = encode_words(tokenizer, words, padding)
+    named_models = [(name, get_inference_model(name)) for name in model_names]
+    results = {}
+    for group in group_for_inference(named_models):
+        models = [model for _, model in group]
+        with service_metrics.model_operation('predict'):
+            if isinstance(models[0], numpy_inference.NumpyModel):
+                group_probabilities = numpy_inference.predict_stacked(models, padded)
+            elif isinstance(models[0], tflite_inference.TFLiteModel):
+                group_probabilities = [models[0].predict(np.expand_dims(padded, axis=2))]
+            else:
+                group_probabilities = stacked_inference.StackedModels(models).predict(padded)
+        for (name, _), probabilities in zip(group, group_probabilities):
+            results[name] = {
+                "model": name,
+                "labels": [labels[int(index)] for index in np.argmax(probabilities, axis=1)],
+                "probabilities": probabilities.tolist()
+            }
+    return {"words": list(words), "classes": labels, "models": [results[name] for name in model_names]}
+
+
+# Groups the models that run in one stacked pass: Keras models and numpy exports sharing an architecture. Each TFLite
+# interpreter runs on its own.
+def group_for_inference(named_models):
+    groups = {}
+    for name, model in named_models:
+        if isinstance(model, numpy_inference.NumpyModel):
+            key = ('numpy', model.signature())
+        elif isinstance(model, tflite_inference.TFLiteModel):
+            key = ('tflite', name)
+        else:
+            key = ('keras', stacked_inference.architecture_signature(model))
+        groups.setdefault(key, []).append((name, model))
+    return list(groups.values())
+
+
+def list_class_models(class_code):
+    pending = {name for name in model_writer.pending() if extract_class_code_from_name(name) == class_code}
+    return sorted(pending | set(registry.names(class_code)))
+
+
+def encode_words(tokenizer, words, padding=16):
+    padding = max(padding, len(max(words, key=len)))
+    return ts_utils.encode_words(tokenizer, words, padding)
+
+
+# Creates a student as a lazy copy of the base model: only its registry row is written, reads are served by the
+# (already loaded) base model, and the model is materialized by its first teach.
 def load_new(model_name, curriculum=True, kfolds=True):
 
     base_model_name = "curriculum_under_trained_k_folds"
 
-    # Load the pre-trained model
-    original_model = get_pretrained_model(base_model_name)
+    # Load the pre-trained model, which serves the student until it is taught.
+    get_pretrained_model(base_model_name)
+
+    # A student created again starts over from the base model.
+    model_writer.cancel(model_name)
+    for path in (resolve_model_path(model_name), delta_storage.delta_path(resolve_model_path(model_name))):
+        if os.path.exists(path):
+            os.remove(path)
+    forget_model(model_name)
+
+    registry.register_lazy(model_name, base_model_name, stored_model_path(base_model_name))
+
+
+# Drops everything cached in this process about the model.
+def forget_model(model_name):
+    loaded_models.invalidate(model_name)
+    numpy_models.invalidate(model_name)
+    tflite_models.invalidate(model_name)
+    tflite_rejected.pop(model_name, None)
+    predictions.invalidate(model_name)
+    evaluations.invalidate(model_name)
+    teaching_sessions.end(model_name)
+
 
-    # Clone the model
-    copy = keras.models.clone_model(original_model)
+# Base model serving the student when it is lazy (created by load_new and not taught yet), None otherwise.
+def lazy_base(name, directory="models/", extension=".keras"):
+    if name.endswith(extension):
+        name = name[:-len(extension)]
+    if not is_student_model(name):
+        return None
+    filepath = resolve_model_path(name, directory, extension)
+    if os.path.exists(filepath) or os.path.exists(delta_storage.delta_path(filepath)):
+        return None
+    row = registry.get(name)
+    if row is None or row['archived']:
+        return None
+    return row['base']
 
-    # Copy the weights from the original model to the cloned model
-    copy.set_weights(original_model.get_weights())
 
-    # Save the cloned model under the new model name
-    save_pretrained_model(copy, name=model_name)
+# Gives the lazy students of the base model their own copy of its current file, before it is overwritten or deleted.
+def materialize_lazy_students(base_name, directory="models/", extension=".keras"):
+    base_path = stored_model_path(base_name, directory, extension)
+    if not os.path.exists(base_path):
+        return
+    for model_name in registry.lazy_names(base_name):
+        filepath = resolve_model_path(model_name, directory, extension)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        tmp_path = model_persistence.temporary_path(filepath)
+        shutil.copyfile(base_path, tmp_path)
+        os.replace(tmp_path, filepath)
+        service_metrics.bytes_written('keras', filepath)
+        registry.register(model_name, filepath)
+        print(f"(LS) Materialized {model_name} before {base_name} changes.")
 
 
 
 def delete_model(model_name):
+    was_pending = model_writer.cancel(model_name)
     model_path = get_model_path(model_name)
     if not os.path.exists(model_path):
+        model_path = delta_storage.delta_path(model_path)
+    if model_name == "curriculum_under_trained_k_folds":
+        materialize_lazy_students(model_name)
+    if os.path.exists(model_path):
+        os.remove(model_path)
+    elif not was_pending and lazy_base(model_name) is None:
         raise FileNotFoundError(f"Model {model_name} does not exist")
-    os.remove(model_path)
+    tflite_path = tflite_inference.export_path(get_model_path(model_name))
+    for path in (tflite_path, tflite_inference.metadata_path(tflite_path)):
+        if os.path.exists(path):
+            os.remove(path)
+    registry.remove(model_name)
+    forget_model(model_name)
+    model_histories.delete(model_name)
 
 
 def get_model_path(model_name):
@@ -197,27 +420,114 @@ def get_model_path(model_name):
 
 
 def evaluate(model_names, x_test, y_test):
+    evaluated = {}
+    for model_name, evaluation, error in iter_evaluate(model_names, x_test, y_test):
+        if error is not None:
+            print(f"Error evaluating {model_name}: {error}")
+        else:
+            evaluated[model_name] = evaluation
     results = []
     for model_name in model_names:
-        try:
-            model = get_pretrained_model(model_name)
-            print(f"(CL) Evaluating {model_name} ...")
-            evaluation = model.evaluate(np.expand_dims(x_test, axis=2), y_test, verbose=0)
-
-            metrics = {}
-            for metric_name, value in zip(model.metrics_names, evaluation):
-                metrics[metric_name] = value
+        if model_name in evaluated:
             results.append({
                 "model": model_name,
-                "metrics": metrics
+                "metrics": evaluated[model_name]["metrics"]
             })
-        except Exception as e:
-            print(f"Error evaluating {model_name}: {e}")
     return results
 
 
+# Yields (model_name, evaluation, error) as soon as each model is evaluated. Models are loaded on a thread pool while
+# the already loaded ones are evaluated, and models sharing an architecture are evaluated in one stacked pass.
+def iter_evaluate(model_names, x_test, y_test):
+    dataset = evaluation_cache.dataset_fingerprint(x_test, y_test)
+    pending = {}
+    with ThreadPoolExecutor(max_workers=evaluate_workers) as executor:
+        futures = {executor.submit(load_for_evaluation, model_name, dataset): model_name
+                   for model_name in dict.fromkeys(model_names)}
+        for future in as_completed(futures):
+            model_name = futures[future]
+            try:
+                version, evaluation, model = future.result()
+            except Exception as e:
+                yield model_name, None, e
+                continue
+            if evaluation is not None:
+                yield model_name, evaluation, None
+                continue
+            try:
+                signature = stacked_inference.architecture_signature(model)
+            except (ValueError, AttributeError):
+                signature = model_name
+            group = pending.setdefault(signature, [])
+            group.append((model_name, version, model))
+            if len(group) >= evaluate_batch_size:
+                yield from evaluate_group(pending.pop(signature), x_test, y_test)
+    for group in pending.values():
+        yield from evaluate_group(group, x_test, y_test)
+
+
+def load_for_evaluation(model_name, dataset):
+    filepath = stored_model_path(model_name)
+    version = (filepath, model_cache.file_signature(filepath), dataset, evaluation_backend())
+    evaluation = evaluations.get(model_name, version)
+    if evaluation is not None:
+        return version, evaluation, None
+    return version, None, get_evaluation_model(model_name)
+
+
+# Evaluations measure the TFLite exports when they serve the predictions, and the Keras models otherwise.
+def evaluation_backend():
+    return "tflite" if inference_backend == "tflite" else "keras"
+
+
+def get_evaluation_model(model_name):
+    if evaluation_backend() == "tflite":
+        # The evaluation is cached as that of the export, so it waits for the export instead of measuring Keras.
+        export = refresh_tflite_export(model_name)
+        if export is not None:
+            export.result()
+        return get_inference_model(model_name)
+    return get_pretrained_model(model_name)
+
+
+def evaluate_group(group, x_test, y_test):
+    try:
+        if len(group) > 1:
+            print(f"(CL) Evaluating {', '.join(name for name, _, _ in group)} in one pass ...")
+            with service_metrics.model_operation('predict'):
+                probabilities = stacked_inference.StackedModels([model for _, _, model in group]).predict(x_test)
+        else:
+            print(f"(CL) Evaluating {group[0][0]} ...")
+            with service_metrics.model_operation('predict'):
+                probabilities = [group[0][2].predict(np.expand_dims(x_test, axis=2), verbose=0)]
+    except Exception as e:
+        for model_name, _, _ in group:
+            yield model_name, None, e
+        return
+    for (model_name, version, model), model_probabilities in zip(group, probabilities):
+        evaluation = evaluation_cache.summarize(model, model_probabilities, y_test)
+        evaluations.put(model_name, version, evaluation)
+        yield model_name, evaluation, None
+
+
+# Metrics, predicted classes and confusion matrix of a model over the test set, cached per model file version.
+def evaluate_model(model_name, x_test, y_test):
+    filepath = stored_model_path(model_name)
+    version = (filepath, model_cache.file_signature(filepath), evaluation_cache.dataset_fingerprint(x_test, y_test),
+               evaluation_backend())
+    return evaluations.get_or_compute(model_name, version, lambda: compute_evaluation(model_name, x_test, y_test))
+
+
+def compute_evaluation(model_name, x_test, y_test):
+    model = get_evaluation_model(model_name)
+    print(f"(CL) Evaluating {model_name} ...")
+    with service_metrics.model_operation('predict'):
+        probabilities = model.predict(np.expand_dims(x_test, axis=2), verbose=0)
+    return evaluation_cache.summarize(model, probabilities, y_test)
+
+
 def train(model_name, x_train, y_train, validation_split=0.25, epochs=12):
-    model = get_pretrained_model(model_name)
+    model = get_writable_model(model_name)
     train_model(model, model_name, x_train, y_train, validation_split, epochs)
 
 
@@ -229,30 +539,47 @@ def plot_model_history_progression(history_progression, validation_data=True):
     graph_utils.plot_progression(history_progression, validation_data)
 
 
-def train_model(model, model_name, x_train, y_train, validation_split=0.25, epochs=15):
-    train_history = model.fit(np.expand_dims(x_train, axis=2), y_train,
-                              validation_split=validation_split, epochs=epochs,
-                              callbacks=[tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=2)])
+def train_model(model, model_name, x_train, y_train, validation_split=0.25, epochs=15, callbacks=None):
+    import tensorflow as tf
+    data = input_pipeline.TrainingData.from_stages([x_train], [y_train])
+    train_dataset, val_dataset = data.split_datasets(data.stage_indices(0), validation_split)
+    with service_metrics.model_operation('fit'):
+        train_history = model.fit(train_dataset, validation_data=val_dataset, epochs=epochs,
+                                  callbacks=[tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=2)] +
+                                  (callbacks or []))
 
     save_pretrained_model(model, name=model_name)
     model_histories[model_name] = train_history.history
     return train_history
 
 
-def train_model_with_kfolds(model, model_name, x_train, y_train, epochs=15):
+def train_model_with_kfolds(model, model_name, x_train, y_train, epochs=15, parallel=None, combine=None):
+    import tensorflow as tf
     k = 5
     skf = StratifiedKFold(n_splits=k, shuffle=True, random_state=42)
     aggregated_history = {'accuracy': [], 'loss': [], 'val_accuracy': [], 'val_loss': []}
-    y_labels = np.argmax(y_train, axis=1)
+    data = input_pipeline.TrainingData.from_stages([x_train], [y_train])
+    indices = data.stage_indices(0)
+    y_labels = data.labels(indices)
     histories = []
-    for fold, (train_idx, val_idx) in enumerate(skf.split(x_train, y_labels)):
+    if kfold_parallel if parallel is None else parallel:
+        print(f"Training {k} folds in parallel...")
+        fold_stages = [[(indices[train_idx], indices[val_idx], epochs)]
+                       for train_idx, val_idx in skf.split(indices, y_labels)]
+        histories = parallel_folds.train_folds(model, data, fold_stages, combine or kfold_combine)
+        for fold_history in histories:
+            for key in aggregated_history.keys():
+                aggregated_history[key].extend(fold_history[0][key])
+        save_pretrained_model(model, name=model_name)
+        model_histories[model_name] = aggregated_history
+        return histories
+    for fold, (train_idx, val_idx) in enumerate(skf.split(indices, y_labels)):
         print(f"Training on fold {fold + 1}/{k}...")
-        x_train_fold, x_val_fold = x_train[train_idx], x_train[val_idx]
-        y_train_fold, y_val_fold = y_train[train_idx], y_train[val_idx]
-        history = model.fit(np.expand_dims(x_train_fold, axis=2), y_train_fold,
-                            validation_data=(np.expand_dims(x_val_fold, axis=2), y_val_fold),
-                            epochs=epochs,
-                            callbacks=[tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=2)])
+        train_dataset, val_dataset = data.fold_datasets(indices, train_idx, val_idx)
+        with service_metrics.model_operation('fit'):
+            history = model.fit(train_dataset, validation_data=val_dataset,
+                                epochs=epochs,
+                                callbacks=[tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=2)])
         histories.append(history)
         for key in aggregated_history.keys():
             aggregated_history[key].extend(history.history[key])
@@ -263,11 +590,12 @@ def train_model_with_kfolds(model, model_name, x_train, y_train, epochs=15):
 
 
 def curriculum_train(model_name, x_train_list, y_train_list, validation_split=None, epochs=None):
-    model = get_pretrained_model(model_name)
+    model = get_writable_model(model_name)
     curriculum_train_model(model, model_name, x_train_list, y_train_list, validation_split, epochs)
 
 
 def curriculum_train_model(model, model_name, x_train_list, y_train_list, validation_split=None, epochs=None):
+    import tensorflow as tf
     if epochs is None:
         epochs = [2, 4, 8]
     if validation_split is None:
@@ -276,17 +604,16 @@ def curriculum_train_model(model, model_name, x_train_list, y_train_list, valida
         raise Exception("x_train and y_train dataSet lists must match in size.")
     if len(validation_split) != len(epochs):
         raise Exception("x_train and y_train dataSet lists must match in size.")
-    stacked_x_train = np.empty((0, 16))
-    stacked_y_train = np.empty((0, 3))
+    # Every stage trains on the previous stages stacked with its own samples.
+    data = input_pipeline.TrainingData.from_stages(x_train_list, y_train_list)
     aggregated_history = {'accuracy': [], 'loss': [], 'val_accuracy': [], 'val_loss': []}
     # Curriculum learning with the best hp.
     curriculum_learning_progress = []
-    for x, y, val, epochs in zip(x_train_list, y_train_list, validation_split, epochs):
-        stacked_x_train = np.vstack((stacked_x_train, x))
-        stacked_y_train = np.vstack((stacked_y_train, y))
-        model_result = model.fit(np.expand_dims(stacked_x_train, axis=2), stacked_y_train,
-                                 validation_split=val, epochs=epochs,
-                                 callbacks=[tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=2)])
+    for stage, (val, epochs) in enumerate(zip(validation_split, epochs)):
+        train_dataset, val_dataset = data.split_datasets(data.stacked_indices(stage), val)
+        with service_metrics.model_operation('fit'):
+            model_result = model.fit(train_dataset, validation_data=val_dataset, epochs=epochs,
+                                     callbacks=[tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=2)])
         curriculum_learning_progress.append(model_result)
         val_acc_per_epoch = model_result.history['val_accuracy']
         best_epoch = val_acc_per_epoch.index(max(val_acc_per_epoch)) + 1
@@ -299,7 +626,9 @@ def curriculum_train_model(model, model_name, x_train_list, y_train_list, valida
     return curriculum_learning_progress
 
 
-def curriculum_train_model_with_kfolds(model, model_name, x_train_list, y_train_list, epochs_list=None):
+def curriculum_train_model_with_kfolds(model, model_name, x_train_list, y_train_list, epochs_list=None,
+                                       parallel=None, combine=None):
+    import tensorflow as tf
     if epochs_list is None:
         epochs_list = [3, 8, 15]
     k = 5
@@ -309,19 +638,37 @@ def curriculum_train_model_with_kfolds(model, model_name, x_train_list, y_train_
         raise Exception("x_train and y_train dataSet lists must match in size.")
     if len(epochs_list) != len(x_train_list):
         raise Exception("Epochs list must match x_train_list size.")
+    data = input_pipeline.TrainingData.from_stages(x_train_list, y_train_list)
+    stage_indices = [data.stage_indices(stage) for stage in range(len(x_train_list))]
+
+    if kfold_parallel if parallel is None else parallel:
+        # Fold f of the parallel mode goes through every curriculum stage using the f-th split of each stage.
+        print(f"Curriculum learning on {k} folds in parallel...")
+        stage_splits = [list(skf.split(indices, data.labels(indices))) for indices in stage_indices]
+        fold_stages = [[(indices[splits[fold][0]], indices[splits[fold][1]], epochs)
+                        for indices, epochs, splits in zip(stage_indices, epochs_list, stage_splits)]
+                       for fold in range(k)]
+        fold_histories = parallel_folds.train_folds(model, data, fold_stages, combine or kfold_combine)
+        # Same order as the sequential mode: stage by stage, fold by fold.
+        for stage in range(len(x_train_list)):
+            for fold_history in fold_histories:
+                for key in aggregated_history.keys():
+                    aggregated_history[key].extend(fold_history[stage][key])
+        save_pretrained_model(model, name=model_name)
+        model_histories[model_name] = aggregated_history
+        return fold_histories
 
     curriculum_learning_progress = []
-    for x_train, y_train, epochs in zip(x_train_list, y_train_list, epochs_list):
-        y_labels = np.argmax(y_train, axis=1)
-        for fold, (train_idx, val_idx) in enumerate(skf.split(x_train, y_labels)):
+    for indices, epochs in zip(stage_indices, epochs_list):
+        y_labels = data.labels(indices)
+        for fold, (train_idx, val_idx) in enumerate(skf.split(indices, y_labels)):
             print(f"Curriculum learning on fold {fold + 1}/{k}...")
-            x_train_fold, x_val_fold = x_train[train_idx], x_train[val_idx]
-            y_train_fold, y_val_fold = y_train[train_idx], y_train[val_idx]
+            train_dataset, val_dataset = data.fold_datasets(indices, train_idx, val_idx)
 
-            history = model.fit(np.expand_dims(x_train_fold, axis=2), y_train_fold,
-                                validation_data=(np.expand_dims(x_val_fold, axis=2), y_val_fold),
-                                epochs=epochs,
-                                callbacks=[tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=2)])
+            with service_metrics.model_operation('fit'):
+                history = model.fit(train_dataset, validation_data=val_dataset,
+                                    epochs=epochs,
+                                    callbacks=[tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=2)])
             curriculum_learning_progress.append(history)
             for key in aggregated_history.keys():
                 aggregated_history[key].extend(history.history[key])
@@ -331,38 +678,161 @@ def curriculum_train_model_with_kfolds(model, model_name, x_train_list, y_train_
     return curriculum_learning_progress
 
 
+# Class code of a student model name, None for default models.
 def extract_class_code_from_name(name):
-    parts = name.split("_")
-    if len(parts) == 3:
-        return parts[1]
-    else:
-        return None
+    return model_registry.parse_model_name(name)[1]
+
+
+def is_student_model(name):
+    return extract_class_code_from_name(name) is not None
 
 
 # Get AI model.
 def get_pretrained_model(name="example", directory="models/", extension=".keras"):
-    base_model_name = "curriculum_under_trained_k_folds"
-    
-    # Check if the model name matches the base model name
-    if name == base_model_name:
-        # Load the base model directly from the /models folder
+    registry.touch(name[:-len(extension)] if name.endswith(extension) else name)
+    pending = model_writer.pending_model(name[:-len(extension)] if name.endswith(extension) else name)
+    if pending is not None:
+        return pending
+    base_name = lazy_base(name, directory, extension)
+    if base_name is not None:
+        return get_pretrained_model(base_name, directory, extension)
+    filepath = stored_model_path(name, directory, extension)
+    if filepath.endswith(delta_storage.DELTA_EXTENSION):
+        return loaded_models.get(name, filepath, lambda path: load_delta_model(path, directory))
+    return loaded_models.get(name, filepath, load_keras_model)
+
+
+def load_keras_model(filepath):
+    import keras
+    with service_metrics.model_operation('load_model'):
+        return keras.models.load_model(filepath)
+
+
+def load_delta_model(filepath, directory="models/"):
+    base_model = get_pretrained_model("curriculum_under_trained_k_folds", directory)
+    return delta_storage.load_delta(filepath, base_model, get_models_root(directory))
+
+
+# Get the model used to serve predictions with the configured backend. Exports are made from the written files, so a
+# save that is still pending is served from memory by Keras until it is written.
+def get_inference_model(name, directory="models/", extension=".keras"):
+    if inference_backend not in ("numpy", "tflite") or name in model_writer.pending():
+        return get_pretrained_model(name, directory, extension)
+    base_name = lazy_base(name, directory, extension)
+    if base_name is not None:
+        return get_inference_model(base_name, directory, extension)
+    if inference_backend == "tflite":
+        return get_tflite_model(name, directory, extension)
+    registry.touch(name)
+    source_path = stored_model_path(name, directory, extension)
+    export_path = numpy_inference.export_path(resolve_model_path(name, directory, extension))
+    # Export lazily, and again whenever the model has been saved after the export.
+    if not os.path.exists(export_path) or os.path.getmtime(export_path) < os.path.getmtime(source_path):
+        numpy_inference.export_model(get_pretrained_model(name, directory, extension), export_path)
+    return numpy_models.get(name, export_path, numpy_inference.NumpyModel.load)
+
+
+# Get the TFLite export of a model, or the Keras model while its export is being made or fails the accuracy check.
+def get_tflite_model(name, directory="models/", extension=".keras"):
+    registry.touch(name)
+    if refresh_tflite_export(name, directory, extension) is not None or name in tflite_rejected:
+        return get_pretrained_model(name, directory, extension)
+    return tflite_models.get(name, export_path_of(name, directory, extension), tflite_inference.TFLiteModel.load)
+
+
+def export_path_of(name, directory="models/", extension=".keras"):
+    return tflite_inference.export_path(resolve_model_path(name, directory, extension))
+
+
+# Queues the TFLite export of the model file unless its export is fresh (or was rejected). Returns the future of the
+# queued or running export, None when there is nothing to export.
+def refresh_tflite_export(name, directory="models/", extension=".keras"):
+    source_path = stored_model_path(name, directory, extension)
+    export_path = export_path_of(name, directory, extension)
+    if os.path.exists(export_path) and os.path.getmtime(export_path) >= os.path.getmtime(source_path):
+        return None
+    if tflite_rejected.get(name) == model_cache.file_signature(source_path):
+        return None
+    with tflite_exports_lock:
+        if name not in tflite_exports:
+            tflite_exports[name] = tflite_exporter.submit(run_tflite_export, name, directory, extension)
+        return tflite_exports[name]
+
+
+# Exports the model as its file is now. A save written meanwhile makes the export stale even though it is newer than
+# the file, so it is removed and the model exported again.
+def run_tflite_export(name, directory="models/", extension=".keras"):
+    source_path = stored_model_path(name, directory, extension)
+    signature = model_cache.file_signature(source_path)
+    changed = False
+    try:
+        export_tflite_model(name, get_pretrained_model(name, directory, extension),
+                            resolve_model_path(name, directory, extension), source_path)
+        changed = model_cache.file_signature(stored_model_path(name, directory, extension)) != signature
+        if changed:
+            remove_tflite_export(name, directory, extension)
+    except Exception as e:
+        print(f"(TL) Could not export {name}: {e}")
+    finally:
+        with tflite_exports_lock:
+            tflite_exports.pop(name, None)
+    if changed and os.path.exists(stored_model_path(name, directory, extension)):
+        refresh_tflite_export(name, directory, extension)
+
+
+def remove_tflite_export(name, directory="models/", extension=".keras"):
+    export_path = export_path_of(name, directory, extension)
+    for path in (export_path, tflite_inference.metadata_path(export_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# Exports the model next to its .keras path, calibrated on x_train and checked against the Keras model on x_test.
+# source_path is the file actually holding the model (the .keras file or its delta).
+def export_tflite_model(name, model, keras_path, source_path):
+    dataset, _, _ = dataset_cache.load_or_build()
+    try:
+        tflite_inference.export_and_verify(model, keras_path, dataset['x_train'], dataset['x_test'], dataset['y_test'])
+    except ValueError as e:
+        print(f"(TL) Serving {name} with Keras: {e}")
+        tflite_rejected[name] = model_cache.file_signature(source_path)
+        return False
+    service_metrics.bytes_written('tflite', tflite_inference.export_path(keras_path))
+    tflite_rejected.pop(name, None)
+    return True
+
+
+# Default models are stored in the models folder and student models in the folder of their class.
+def resolve_model_path(name, directory="models/", extension=".keras"):
+    class_code = extract_class_code_from_name(name)
+    if class_code is None:
         filepath = os.path.join(os.path.dirname(__file__), directory, name + extension)
     else:
-        # For other models, extract the class code and construct the path accordingly
-        class_code = name.split("_")[1]  # Assuming the format is "studentName_classCode_timestamp"
         filepath = os.path.join(os.path.dirname(__file__), directory, class_code, name + extension)
-    
-    return keras.models.load_model(filepath)
+    return os.path.abspath(filepath)
+
 
+# Path of the file actually holding the model: the .keras file, its weight delta for migrated students, or the file
+# of the base model for lazy students.
+def stored_model_path(name, directory="models/", extension=".keras"):
+    filepath = resolve_model_path(name, directory, extension)
+    candidate = delta_storage.delta_path(filepath)
+    if not os.path.exists(filepath) and os.path.exists(candidate):
+        return candidate
+    base_name = lazy_base(name, directory, extension)
+    if base_name is not None:
+        return stored_model_path(base_name, directory, extension)
+    return filepath
 
-def has_numbers(name):
-    return bool(re.search(r'\d', name))
+
+def get_models_root(directory="models/"):
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), directory))
 
 
 # Save AI model.
 def save_pretrained_model(model, name="example", directory="models/", extension=".keras"):
-    if has_numbers(name):
-        class_code = extract_class_code_from_name(name)
+    class_code = extract_class_code_from_name(name)
+    if class_code is not None:
         dir_path = os.path.join(directory, class_code)
     else:
         dir_path = directory
@@ -373,14 +843,60 @@ def save_pretrained_model(model, name="example", directory="models/", extension=
     if not name.endswith(extension):
         name += extension
 
+    model_name = name[:-len(extension)]
     file_path = os.path.join(dir_path, name)
-    model.save(file_path)
+    if model_storage == "delta" and class_code is not None:
+        # Store students as a compressed delta against the base model and drop any older full copy.
+        stale_path, file_path = file_path, delta_storage.delta_path(file_path)
+        base_model = get_pretrained_model("curriculum_under_trained_k_folds", directory)
+        write = lambda: delta_storage.save_delta(model, file_path, base_model, get_models_root(directory))
+    else:
+        stale_path = delta_storage.delta_path(file_path)
+        write = lambda: model_persistence.atomic_save(model, file_path)
+
+    def write_model():
+        if model_name == "curriculum_under_trained_k_folds":
+            materialize_lazy_students(model_name, directory, extension)
+        with service_metrics.model_operation('save'):
+            write()
+        service_metrics.bytes_written('keras' if file_path.endswith(extension) else 'delta', file_path)
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+
+    # The readers get a copy of the saved weights, as the model itself may keep being trained (e.g. by a warm
+    # teaching session).
+    served_model = inference_copy(model)
+
+    def on_written():
+        registry.register(model_name, file_path)
+        loaded_models.put(model_name, served_model, os.path.abspath(file_path))
+        teaching_sessions.saved(model_name, file_path)
+        if not is_student_model(model_name):
+            # The vocabulary table of the new weights is ready before the first prediction that needs it.
+            build_vocabulary_table(model_name)
+        if inference_backend == "tflite":
+            # Export right after the save instead of on the first prediction, in the background.
+            refresh_tflite_export(model_name, directory, extension)
+
+    # Dropped before the save is scheduled, as a save written right away builds the new vocabulary table.
+    evaluations.invalidate(model_name)
+    predictions.invalidate(model_name)
+    # Until it is written, get_pretrained_model serves the saved weights from memory.
+    model_writer.schedule(model_name, served_model, write_model, on_written)
 
 # Function to handle class deletion by moving models to a "_deleted" directory
 def handle_class_deletion(class_code):
     old_dir = os.path.join("models", class_code)
     new_dir = os.path.join("models", f"{class_code}_deleted")
-    
+    # Write the pending saves of the class first, so they are moved with the rest of its models.
+    model_writer.flush_where(lambda name: extract_class_code_from_name(name) == class_code)
+    loaded_models.invalidate_directory(old_dir)
+    numpy_models.invalidate_directory(old_dir)
+    tflite_models.invalidate_directory(old_dir)
+    evaluations.invalidate_where(lambda name: extract_class_code_from_name(name) == class_code)
+    predictions.invalidate_where(lambda name: extract_class_code_from_name(name) == class_code)
+    teaching_sessions.end_where(lambda name: extract_class_code_from_name(name) == class_code)
+
     # Check if the old directory exists
     if os.path.exists(old_dir):
         # Check if the new directory already exists
@@ -398,33 +914,28 @@ def handle_class_deletion(class_code):
         else:
             # If the new directory does not exist, simply rename the old directory
             os.rename(old_dir, new_dir)
-    else:
-        # If the old directory does not exist, do nothing
-        pass
+    # Archive the registry rows in any case: a class whose students are all lazy has no directory.
+    registry.archive_class(class_code, new_dir)
 
 
 # Teach new examples to the model
-def teach(model_name, word_dictionary, tokenizer, padding=16):
-    model = get_pretrained_model(model_name)
+def teach(model_name, word_dictionary, tokenizer, padding=16, callbacks=None):
+    import tensorflow as tf
+    model = teaching_sessions.get(model_name, stored_model_path(model_name),
+                                  lambda path: get_writable_model(model_name), compile_for_teaching)
     added_x, added_y = list(word_dictionary.keys()), \
                        [machine_teaching.encode_target_to_integer(i) for i in word_dictionary.values()]
-    padding = max(padding, len(max(added_x, key=len)))
-    mt_x_encoded = tokenizer.texts_to_sequences(added_x)
-    mt_x_encoded = pad_sequences(mt_x_encoded, maxlen=padding)
+    mt_x_encoded = encode_words(tokenizer, added_x, padding)
     mt_y_encoded = tf.keras.utils.to_categorical(added_y, num_classes=3)
 
-    # Compile model again with lower learning rate to avoid over-adapting to new examples.
-    optimizer = tf.keras.optimizers.Adam(learning_rate=0.0000325)
-    model.compile(optimizer=optimizer,
-                  loss='categorical_crossentropy',
-                  metrics=['accuracy'])
-
-    result = \
-        model.fit(np.expand_dims(mt_x_encoded, axis=2), mt_y_encoded, epochs=3,
-                  validation_split=0.20,
-                  callbacks=[tf.keras.callbacks.EarlyStopping(monitor='val_accuracy')])
+    with service_metrics.model_operation('fit'):
+        result = \
+            model.fit(np.expand_dims(mt_x_encoded, axis=2), mt_y_encoded, epochs=3,
+                      validation_split=0.20,
+                      callbacks=[tf.keras.callbacks.EarlyStopping(monitor='val_accuracy')] + (callbacks or []))
 
-    predictions = model.predict(np.expand_dims(mt_x_encoded, axis=2))
+    with service_metrics.model_operation('predict'):
+        predictions = model.predict(np.expand_dims(mt_x_encoded, axis=2))
     # Now we guess it is the highest probability instead of retrieving N/A.
     max_indices = np.argmax(predictions, axis=1)
     predictions_rounded = np.zeros_like(predictions)
@@ -436,9 +947,53 @@ def teach(model_name, word_dictionary, tokenizer, padding=16):
 
     final_summary = np.column_stack((added_x, expected_labels, predicted_labels))
     save_pretrained_model(model, model_name)
+    model_histories.append(model_name, result.history)
     return result, final_summary
 
 
+# Model to be trained and saved as model_name. It is always an instance of its own, never the one the model caches
+# share with the readers: a lazy student is materialized here as a copy of the base model, compiled with the optimizer,
+# loss and metrics of the base (with a fresh optimizer state), any other model is loaded again from its file, optimizer
+# state included (after writing a save of it that is still pending).
+def get_writable_model(model_name):
+    base_name = lazy_base(model_name)
+    if base_name is not None:
+        print(f"(LS) Materializing {model_name} from {base_name} ...")
+        # The cached base is a weights-only copy, so the compile settings come from the base loaded from its file.
+        base_model = get_writable_model(base_name)
+        model = inference_copy(base_model)
+        if base_model.compiled:
+            model.compile_from_config(base_model.get_compile_config())
+        return model
+    model_writer.flush([model_name])
+    registry.touch(model_name)
+    filepath = stored_model_path(model_name)
+    if filepath.endswith(delta_storage.DELTA_EXTENSION):
+        return load_delta_model(filepath)
+    return load_keras_model(filepath)
+
+
+# Copy of the weights of a model in a new instance, e.g. for the readers of a model that keeps being trained.
+def inference_copy(model):
+    import keras
+    copy = keras.models.clone_model(model)
+    copy.set_weights(model.get_weights())
+    return copy
+
+
+# Compile model again with lower learning rate to avoid over-adapting to new examples. A model saved by a previous
+# teaching round already carries this optimizer and its state, which is kept.
+def compile_for_teaching(model):
+    import tensorflow as tf
+    optimizer = getattr(model, 'optimizer', None)
+    if isinstance(optimizer, tf.keras.optimizers.Adam) and \
+            np.isclose(float(optimizer.learning_rate), teaching_learning_rate):
+        return
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=teaching_learning_rate),
+                  loss='categorical_crossentropy',
+                  metrics=['accuracy'])
+
+
 def label_result_single(prediction, labels=None):
     if labels is None:
         labels = ['d', 'h', 'g']
@@ -461,32 +1016,32 @@ def label_result(prediction, labels=None):
     return [labels[np.where(row == 1)[0][0]] if np.any(row) else '' for row in prediction]
 
 
-def train_missing_models(models_missing, models_to_train, x_train, y_train,
-                         stacked_x_01, stacked_y_01, stacked_x_012, stacked_y_012):
-    for model_name in models_missing:
-        model = models_to_train[model_name]
-
-        if model_name == "max.keras":
-            train_model(model, model_name, x_train, y_train)
-        elif model_name == "curriculum_max.keras":
-            curriculum_train_model(model, model_name, stacked_x_012, stacked_y_012)
-        elif model_name == "under_trained.keras":
-            train_model(model, model_name, x_train, y_train, epochs=1)
-        elif model_name == "curriculum_under_trained.keras":
-            curriculum_train_model(model, model_name, stacked_x_01, stacked_y_01,
-                                   validation_split=[0.15, 0.25], epochs=[1, 1])
-        elif model_name == "max_k_folds.keras":
-            train_model_with_kfolds(model, model_name, x_train, y_train)
-        elif model_name == "curriculum_max_k_folds.keras":
-            curriculum_train_model_with_kfolds(model, model_name, stacked_x_012, stacked_y_012)
-        elif model_name == "under_trained_k_folds.keras":
-            train_model_with_kfolds(model, model_name, x_train, y_train, epochs=1)
-        elif model_name == "curriculum_under_trained_k_folds.keras":
-            curriculum_train_model_with_kfolds(model, model_name, stacked_x_01, stacked_y_01, [1, 1])
+# Trains one of the default models with its schedule. callbacks are only supported by the conventional schedules
+# (train_model), the only ones with snapshots in training_plan.
+def train_default_model(model, model_name, x_train, y_train, stacked_x_01, stacked_y_01, stacked_x_012,
+                        stacked_y_012, callbacks=None):
+    if model_name == "max.keras":
+        train_model(model, model_name, x_train, y_train, callbacks=callbacks)
+    elif model_name == "curriculum_max.keras":
+        curriculum_train_model(model, model_name, stacked_x_012, stacked_y_012)
+    elif model_name == "under_trained.keras":
+        train_model(model, model_name, x_train, y_train, epochs=1, callbacks=callbacks)
+    elif model_name == "curriculum_under_trained.keras":
+        curriculum_train_model(model, model_name, stacked_x_01, stacked_y_01,
+                               validation_split=[0.15, 0.25], epochs=[1, 1])
+    elif model_name == "max_k_folds.keras":
+        train_model_with_kfolds(model, model_name, x_train, y_train)
+    elif model_name == "curriculum_max_k_folds.keras":
+        curriculum_train_model_with_kfolds(model, model_name, stacked_x_012, stacked_y_012)
+    elif model_name == "under_trained_k_folds.keras":
+        train_model_with_kfolds(model, model_name, x_train, y_train, epochs=1)
+    elif model_name == "curriculum_under_trained_k_folds.keras":
+        curriculum_train_model_with_kfolds(model, model_name, stacked_x_01, stacked_y_01, [1, 1])
 
 
 def reset(x, y, x_train, y_train, x_train0, y_train0, x_increment_01, y_increment_01, x_increment_012, y_increment_012,
-          models_missing=None):
+          models_missing=None, progress=None):
+    import tensorflow as tf
     if models_missing is None:
         models_missing = []
     # Initial configuration.
@@ -510,37 +1065,18 @@ def reset(x, y, x_train, y_train, x_train0, y_train0, x_increment_01, y_incremen
     # Initialize weights to be able to store the model in a temp file, curriculum.
     best_model_curriculum.build((None, 16, 1))
 
-    # Serialize best model into a temporal .keras file.
-    serialize_model(best_model)
-
-    # Deserialize the model to create every necessary copy.
-    conventional_max = deserialize_model()
-    conventional_under_trained = deserialize_model()
-    conventional_max_k_folds = deserialize_model()
-    conventional_under_trained_k_folds = deserialize_model()
-
-    os.remove("temp_model.keras")
-    serialize_model(best_model_curriculum)
-
-    curriculum_max = deserialize_model()
-    curriculum_under_trained = deserialize_model()
-    curriculum_max_k_folds = deserialize_model()
-    curriculum_under_trained_k_folds = deserialize_model()
-
-    os.remove("temp_model.keras")
-
-    models_to_train = {
-        "max.keras": conventional_max,
-        "curriculum_max.keras": curriculum_max,
-        "under_trained.keras": conventional_under_trained,
-        "curriculum_under_trained.keras": curriculum_under_trained,
-        "max_k_folds.keras": conventional_max_k_folds,
-        "curriculum_max_k_folds.keras": curriculum_max_k_folds,
-        "under_trained_k_folds.keras": conventional_under_trained_k_folds,
-        "curriculum_under_trained_k_folds.keras": curriculum_under_trained_k_folds
-    }
-    train_missing_models(models_missing, models_to_train, x_train, y_train,
-                         stacked_x_01, stacked_y_01, stacked_x_012, stacked_y_012)
+    # Serialize the best models into temporal .keras files; every model of the plan starts from a fresh copy.
+    serialize_model(best_model, "temp_model.keras")
+    serialize_model(best_model_curriculum, "temp_model_curriculum.keras")
+    initial_paths = {model_name: "temp_model_curriculum.keras" if model_name.startswith("curriculum")
+                     else "temp_model.keras" for model_name in models_missing}
+    try:
+        training_plan.run(training_plan.build_plan(models_missing), initial_paths,
+                          (x_train, y_train, stacked_x_01, stacked_y_01, stacked_x_012, stacked_y_012),
+                          progress=progress)
+    finally:
+        os.remove("temp_model.keras")
+        os.remove("temp_model_curriculum.keras")
 
 
 # Helpful functions to serialize and deserialize models.
@@ -549,4 +1085,4 @@ def serialize_model(model, filename="temp_model.keras"):
 
 
 def deserialize_model(filename="temp_model.keras"):
-    return tf.keras.models.load_model(filename)
+    return load_keras_model(filename)